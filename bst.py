@@ -1,8 +1,15 @@
 import sys
-import unittest
-from typing import TypeAlias, Optional, Callable, Any
-from dataclasses import dataclass
-sys.setrecursionlimit(10**6)
+import os
+import math
+import random
+import mmap
+import struct
+import threading
+from array import array
+from typing import TypeAlias, Optional, Union, Callable, Any, Literal, List, Tuple, Dict, Iterable, Iterator, Sequence, NamedTuple, ClassVar, overload
+from dataclasses import dataclass, field
+from functools import cmp_to_key
+from contextlib import contextmanager
 
 # Value type stored in the BST
 Value : TypeAlias = Any
@@ -16,138 +23,1625 @@ Comparator : TypeAlias = Callable[[Value, Value], bool]
 # Helper type aliases for clarity (defined after BinarySearchTree class)
 ComparisonResult : TypeAlias = bool
 
-# Node in a binary search tree
-@dataclass(frozen=True)
-class Node:
+# cmp-style comparator: negative if a < b, zero if equal, positive if a > b
+ThreeWayComparator : TypeAlias = Callable[[Value, Value], int]
+
+# Extracts the sort key of a value; keys are compared with '<'
+KeyFunction : TypeAlias = Callable[[Value], Any]
+
+# Balancing strategy used by insert/delete:
+#   "none"   - plain binary search tree, height depends on insertion order
+#   "weight" - weight-balanced tree, height is O(log n) for any order
+#   "randomized" - randomized BST (Martinez and Roura), shaped like a
+#                  BST built in random order whatever the actual order,
+#                  so its expected height is O(log n)
+BalanceMode : TypeAlias = Literal["none", "weight", "randomized"]
+
+# Weight-balance parameters (Adams' trees with the (3, 2) setting): a
+# subtree may weigh at most DELTA times its sibling, and GAMMA decides
+# between a single and a double rotation.
+DELTA : int = 3
+GAMMA : int = 2
+
+# Fields of a Node, in tuple order.
+class NodeFields(NamedTuple):
     value: Value
     left: BinTree
     right: BinTree
+    key: Any
+    size: int
+
+# Node in a binary search tree. 'key' caches the sort key of 'value' for
+# trees ordered by a key function (None otherwise). 'size' counts the
+# nodes in the subtree rooted here and is derived from the children on
+# construction. Nodes are immutable tuples: no per-instance __dict__, and
+# construction is a single tuple allocation.
+class Node(NodeFields):
+    __slots__ = ()
+    __match_args__ = ('value', 'left', 'right')
 
-# Data definition for a binary search tree
+    def __new__(cls, value: Value, left: BinTree, right: BinTree, key: Any = None) -> 'Node':
+        size : int = 1
+        if left is not None:
+            size += left.size
+        if right is not None:
+            size += right.size
+        return tuple.__new__(cls, (value, left, right, key, size))
+
+    def __getnewargs__(self) -> Tuple[Value, BinTree, BinTree, Any]:
+        return (self.value, self.left, self.right, self.key)
+
+    def __repr__(self) -> str:
+        return f"Node({self.value!r}, {self.left!r}, {self.right!r})"
+
+# Builds a node from a value, two subtrees and the value's cached key.
+NodeBuilder : TypeAlias = Callable[[Value, BinTree, BinTree, Any], Node]
+
+# Data definition for a binary search tree. The order of the values is
+# given by 'compare' if set, else by 'key' if set, else by 'comes_before'.
+# 'compare' and 'key' let insert/lookup/delete make a single comparison
+# per level instead of two 'comes_before' calls; when either is given it
+# must agree with 'comes_before'. If 'stats' is set, insert/lookup/delete
+# record their costs into it (see with_stats). 'rng' (the random module
+# or a random.Random) drives the choices of the "randomized" mode.
 @dataclass(frozen=True)
 class BinarySearchTree:
     comes_before: Comparator
     tree: BinTree
+    balance: BalanceMode = "none"
+    compare: Optional[ThreeWayComparator] = None
+    key: Optional[KeyFunction] = None
+    stats: Optional['TreeStats'] = field(default=None, compare=False)
+    rng: Any = field(default=random, compare=False, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.compare is not None and self.key is not None:
+            raise ValueError("give at most one of 'compare' and 'key'.")
+
+    # Number of values in the BST, read from the root's size in O(1).
+    def __len__(self) -> int:
+        if self.tree is None:
+            return 0
+        return self.tree.size
 
 # Short alias for convenience
 bst : TypeAlias = BinarySearchTree
     
+# Returns a BST with the same ordering, balancing, stats and random
+# generator as 'BST' but holding 'tree'.
+def with_tree(BST: bst, tree: BinTree) -> bst:
+    return BinarySearchTree(BST.comes_before, tree, BST.balance, BST.compare, BST.key, BST.stats, BST.rng)
+
 # Returns True if 'BST' is empty, False otherwise.
-def is_empty(BST: bst) -> bool:
+def is_empty(BST: Union[bst, 'DenseBST']) -> bool:
+    if isinstance(BST, DenseBST):
+        return BST.count == 0
     if BST.tree is None:
         return True
     return False
 
-# Insert 'value' into 'BST', returning the new BST.
-def insert(BST: bst, value: Value) -> bst:
-    comes_before = BST.comes_before
-    
-    # Helper function to recursively insert the value
-    def insert_helper(tree: BinTree) -> BinTree:
-        if tree is None:
-            return Node(value, None, None)
-            
-        is_less: ComparisonResult = comes_before(value, tree.value)
-        is_greater: ComparisonResult = comes_before(tree.value, value)
-        
-        if is_less:
-            return Node(tree.value, insert_helper(tree.left), tree.right)
-        elif is_greater:
-            return Node(tree.value, tree.left, insert_helper(tree.right))
-        else:
-            # Values are equal, don't insert duplicates
-            return tree
-        
-    return BinarySearchTree(comes_before, insert_helper(BST.tree))
+# Returns the number of nodes in 'tree'.
+def tree_size(tree: BinTree) -> int:
+    if tree is None:
+        return 0
+    return tree.size
 
-# Returns True if 'value' is in 'BST', False otherwise.
-def lookup(BST: bst, value: Value) -> bool:
-    comes_before = BST.comes_before
+# Returns an upper bound on the height of the tree of 'BST': O(log n) for
+# a weight-balanced tree, n otherwise.
+def height_bound(BST: bst) -> int:
+    n : int = tree_size(BST.tree)
+    if BST.balance == "weight":
+        # each subtree holds at most DELTA / (DELTA + 1) of its parent's weight
+        return math.ceil(math.log(n + 1, (DELTA + 1) / DELTA)) + 1
+    return n
 
-    # Helper function to recursively search for the value
-    def lookup_helper(tree: BinTree) -> bool:
-        if tree is None:
-            return False
-        
-        is_less = comes_before(value, tree.value)
-        is_greater = comes_before(tree.value, value)
-        
-        if is_less:
-            return lookup_helper(tree.left)
-        elif is_greater:
-            return lookup_helper(tree.right)
+# Frames kept free above the deepest expected recursion.
+RECURSION_HEADROOM : int = 100
+recursion_limit_lock : threading.Lock = threading.Lock()
+# The recursion limit to restore, and how many recursion_depth blocks
+# (across threads) are open; guarded by recursion_limit_lock.
+recursion_limit_state : Dict[str, int] = {"saved": 0, "open": 0}
+
+# The bulk and set operations recurse once per tree level, and a plain
+# BST can be as tall as it is large. They run their recursion inside
+# this block, which raises the interpreter's recursion limit, only ever
+# upwards, so that 'levels' more frames fit. The limit the program had
+# is restored when the last open block (in any thread) exits, so no
+# raise outlives the calls that needed it.
+@contextmanager
+def recursion_depth(levels: int) -> Iterator[None]:
+    depth : int = 0
+    frame : Any = sys._getframe()
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    needed : int = depth + levels + RECURSION_HEADROOM
+    with recursion_limit_lock:
+        if recursion_limit_state["open"] == 0:
+            recursion_limit_state["saved"] = sys.getrecursionlimit()
+        recursion_limit_state["open"] += 1
+        if needed > sys.getrecursionlimit():
+            sys.setrecursionlimit(needed)
+    try:
+        yield
+    finally:
+        with recursion_limit_lock:
+            recursion_limit_state["open"] -= 1
+            if recursion_limit_state["open"] == 0:
+                sys.setrecursionlimit(recursion_limit_state["saved"])
+
+# Build a weight-balanced node from 'v', 'l' and 'r'. The subtrees must
+# each be balanced and, together, at most one insert or delete away from
+# being in balance with each other.
+def balance_node(v: Value, l: BinTree, r: BinTree, k: Any = None) -> Node:
+    left_weight : int = tree_size(l) + 1
+    right_weight : int = tree_size(r) + 1
+    if right_weight > DELTA * left_weight:
+        assert r is not None
+        rl, rr = r.left, r.right
+        if tree_size(rl) + 1 < GAMMA * (tree_size(rr) + 1):
+            # single left rotation
+            return Node(r.value, Node(v, l, rl, k), rr, r.key)
+        # double rotation: rl becomes the new root
+        assert rl is not None
+        return Node(rl.value, Node(v, l, rl.left, k), Node(r.value, rl.right, rr, r.key), rl.key)
+    if left_weight > DELTA * right_weight:
+        assert l is not None
+        ll, lr = l.left, l.right
+        if tree_size(lr) + 1 < GAMMA * (tree_size(ll) + 1):
+            # single right rotation
+            return Node(l.value, ll, Node(v, lr, r, k), l.key)
+        # double rotation: lr becomes the new root
+        assert lr is not None
+        return Node(lr.value, Node(l.value, ll, lr.left, l.key), Node(v, lr.right, r, k), lr.key)
+    return Node(v, l, r, k)
+
+# Returns the function used to rebuild nodes on the path touched by an
+# update, according to the balancing strategy 'balance'.
+def node_builder(balance: BalanceMode) -> NodeBuilder:
+    match balance:
+        case "none" | "randomized":
+            return Node
+        case "weight":
+            return balance_node
+        case _:
+            raise ValueError(f"unknown balance mode: {balance!r}")
+
+# Root-to-node path recorded while descending: each entry is a node on
+# the path and True if the descent continued into its left subtree.
+Path : TypeAlias = List[Tuple[Node, bool]]
+
+# Rebuild the nodes on 'path' bottom-up around the new subtree 'tree',
+# which replaces the subtree the descent ended in. Untouched siblings are
+# shared with the old version.
+def rebuild_path(path: Path, tree: BinTree, make: NodeBuilder) -> BinTree:
+    for node, went_left in reversed(path):
+        if went_left:
+            tree = make(node.value, tree, node.right, node.key)
         else:
-            # Values are equal, so value already exists
-            return True
-        
-    return lookup_helper(BST.tree)
+            tree = make(node.value, node.left, tree, node.key)
+    return tree
+
+# Returns the key 'BST' caches in the node for 'value' (None unless the
+# BST is ordered by a key function).
+def node_key(BST: bst, value: Value) -> Any:
+    if BST.key is None:
+        return None
+    return BST.key(value)
+
+# Descend from the root of 'BST' towards 'value', making one ordering
+# decision per level. Returns the path taken and the node equal to
+# 'value', or None if 'value' is absent.
+def find_path(BST: bst, value: Value) -> Tuple[Path, BinTree]:
+    path : Path = []
+    tree : BinTree = BST.tree
+    
+    if BST.compare is not None:
+        compare : ThreeWayComparator = BST.compare
+        while tree is not None:
+            order : int = compare(value, tree.value)
+            if order < 0:
+                path.append((tree, True))
+                tree = tree.left
+            elif order > 0:
+                path.append((tree, False))
+                tree = tree.right
+            else:
+                break
+    elif BST.key is not None:
+        k : Any = BST.key(value)
+        while tree is not None:
+            tree_key : Any = tree.key
+            if k < tree_key:
+                path.append((tree, True))
+                tree = tree.left
+            elif tree_key < k:
+                path.append((tree, False))
+                tree = tree.right
+            else:
+                break
+    else:
+        comes_before : Comparator = BST.comes_before
+        while tree is not None:
+            if comes_before(value, tree.value):
+                path.append((tree, True))
+                tree = tree.left
+            elif comes_before(tree.value, value):
+                path.append((tree, False))
+                tree = tree.right
+            else:
+                break
+    return path, tree
+
+# Returns the node of 'BST' equal to 'value', or None if there is none.
+# Same descent as find_path, without recording the path.
+def find_node(BST: bst, value: Value) -> BinTree:
+    tree : BinTree = BST.tree
+    
+    if BST.compare is not None:
+        compare : ThreeWayComparator = BST.compare
+        while tree is not None:
+            order : int = compare(value, tree.value)
+            if order < 0:
+                tree = tree.left
+            elif order > 0:
+                tree = tree.right
+            else:
+                return tree
+    elif BST.key is not None:
+        k : Any = BST.key(value)
+        while tree is not None:
+            tree_key : Any = tree.key
+            if k < tree_key:
+                tree = tree.left
+            elif tree_key < k:
+                tree = tree.right
+            else:
+                return tree
+    else:
+        comes_before : Comparator = BST.comes_before
+        while tree is not None:
+            if comes_before(value, tree.value):
+                tree = tree.left
+            elif comes_before(tree.value, value):
+                tree = tree.right
+            else:
+                # Values are equal, so value already exists
+                return tree
+    return None
+
+# Insert 'value' into 'BST', returning the new BST. Dense trees are
+# routed by the stats check (see DenseBST), off the node engine's path.
+@overload
+def insert(BST: bst, value: Value) -> bst: ...
+@overload
+def insert(BST: 'DenseBST', value: Value) -> 'DenseBST': ...
+def insert(BST: Any, value: Value) -> Any:
+    if BST.stats is not None:
+        if type(BST) is DenseBST:
+            return dense_insert(BST, value)
+        return instrumented_insert(BST, value)
+    if BST.balance == "randomized":
+        new_tree, _ = randomized_insert_tree(BST, value, Node)
+        return BST if new_tree is None else with_tree(BST, new_tree)
+    path, tree = find_path(BST, value)
+    if tree is not None:
+        # Values are equal, don't insert duplicates
+        return BST
+    
+    make : NodeBuilder = node_builder(BST.balance)
+    leaf : Node = Node(value, None, None, node_key(BST, value))
+    return with_tree(BST, rebuild_path(path, leaf, make))
+
+# Returns True if 'value' is in 'BST', False otherwise.
+@overload
+def lookup(BST: bst, value: Value) -> bool: ...
+@overload
+def lookup(BST: 'DenseBST', value: Value) -> bool: ...
+def lookup(BST: Any, value: Value) -> bool:
+    if BST.stats is not None:
+        if type(BST) is DenseBST:
+            return dense_lookup(BST, value)
+        return instrumented_lookup(BST, value)
+    return find_node(BST, value) is not None
 
 
 # Return the largest value in the non-empty 'tree'.
 def largest_value(tree: BinTree) -> Value:
+    return largest_node(tree).value
+
+# Return the node holding the largest value in the non-empty 'tree'.
+def largest_node(tree: BinTree) -> Node:
     match tree:
         case None:
             raise ValueError("tree is empty.")
-        case Node(v, l, r):
-            if r is None:
-                return v
-            return largest_value(r)
+        case Node():
+            while tree.right is not None:
+                tree = tree.right
+            return tree
         
 
-# Delete the largest value in the non-empty 'tree'.
-def delete_largest_value(tree: BinTree) -> BinTree:
+# Delete the largest value in the non-empty 'tree', rebuilding the
+# right spine with 'make'.
+def delete_largest_value(tree: BinTree, make: NodeBuilder = Node) -> BinTree:
     match tree:
         case None:
             raise ValueError("tree is empty.")
-        case Node(v, l, r):
-            if r is None:
-                return l
-            else:
-                new_r : BinTree = delete_largest_value(r)
-                return Node(v, l, new_r)
+        case Node():
+            path : Path = []
+            while tree.right is not None:
+                path.append((tree, False))
+                tree = tree.right
+            return rebuild_path(path, tree.left, make)
 
-# Delete the root of 'tree'
-def delete_root(tree: BinTree) -> BinTree:
+# Delete the root of 'tree', rebuilding nodes with 'make'. The largest
+# value of the left subtree replaces the root; it is found and unlinked
+# in a single walk down the left subtree's right spine.
+def delete_root(tree: BinTree, make: NodeBuilder = Node) -> BinTree:
     match tree:
         case None:
             return None
         case Node(v, l, r):
-            # Get the largest value "left_max" out of "l".
-            # Make a new version of "l" where left_max has been removed from it
-            # Return a new BST where left_max is the new root value, and 
-            #   where the new version of 'l' is used (right subtree unaffected)
             if l is None:
                 return r
+            spine : Path = []
+            left_max : Node = l
+            while left_max.right is not None:
+                spine.append((left_max, False))
+                left_max = left_max.right
+            new_left_subtree : BinTree = rebuild_path(spine, left_max.left, make)
+            return make(left_max.value, new_left_subtree, r, left_max.key)
+
+# Delete 'value' from 'BST' (if present). One descent finds the node and
+# records the path; if 'value' is absent, 'BST' itself is returned.
+@overload
+def delete(BST: bst, value: Value) -> bst: ...
+@overload
+def delete(BST: 'DenseBST', value: Value) -> 'DenseBST': ...
+def delete(BST: Any, value: Value) -> Any:
+    if BST.stats is not None:
+        if type(BST) is DenseBST:
+            return dense_delete(BST, value)
+        return instrumented_delete(BST, value)
+    path, tree = find_path(BST, value)
+    if tree is None:
+        return BST
+    
+    make : NodeBuilder = node_builder(BST.balance)
+    new_tree : BinTree = rebuild_path(path, remove_root(BST.balance, tree, make, BST.rng), make)
+    return with_tree(BST, new_tree)
+
+# Remove the root of 'tree', rebuilding nodes with 'make'. A randomized
+# BST joins the root's subtrees at random, drawing from 'rng', to stay
+# random.
+def remove_root(balance: BalanceMode, tree: Node, make: NodeBuilder, rng: Any = random) -> BinTree:
+    if balance == "randomized":
+        return random_concat(tree.left, tree.right, make, rng)
+    return delete_root(tree, make)
+
+
+# Costs recorded for one kind of operation: how many were made, the
+# calls to the ordering function ('comes_before', 'compare' or 'key'),
+# the nodes visited and the Node objects allocated, summed over all of
+# them, and a histogram of search path lengths (nodes visited on the
+# descent from the root).
+@dataclass
+class OpStats:
+    calls: int = 0
+    comparisons: int = 0
+    nodes_visited: int = 0
+    allocations: int = 0
+    path_lengths: Dict[int, int] = field(default_factory=dict)
+
+# Per-operation stats gathered by an instrumented BST.
+@dataclass
+class TreeStats:
+    insert: OpStats = field(default_factory=OpStats)
+    lookup: OpStats = field(default_factory=OpStats)
+    delete: OpStats = field(default_factory=OpStats)
+
+# Returns 'BST' with instrumentation recording into 'stats', or turned
+# off if 'stats' is None. BSTs derived from it by insert/delete keep
+# recording into the same stats. An uninstrumented BST pays one
+# attribute check per operation.
+def with_stats(BST: bst, stats: Optional[TreeStats]) -> bst:
+    require_nodes(BST, "with_stats")
+    return BinarySearchTree(BST.comes_before, BST.tree, BST.balance, BST.compare, BST.key, stats, BST.rng)
+
+# Returns a copy of 'BST' without stats whose ordering function also
+# bumps 'counter[0]' on each call.
+def counting_view(BST: bst, counter: List[int]) -> bst:
+    def count(f: Callable[..., Any]) -> Callable[..., Any]:
+        def counted(*args: Any) -> Any:
+            counter[0] += 1
+            return f(*args)
+        return counted
+    
+    if BST.compare is not None:
+        return BinarySearchTree(BST.comes_before, BST.tree, BST.balance, count(BST.compare), rng=BST.rng)
+    if BST.key is not None:
+        return BinarySearchTree(BST.comes_before, BST.tree, BST.balance, key=count(BST.key), rng=BST.rng)
+    return BinarySearchTree(count(BST.comes_before), BST.tree, BST.balance, rng=BST.rng)
+
+# Returns 'make' wrapped to add the number of Node objects each call
+# allocates to 'counter[0]': one, or two or three when balance_node
+# rotates. Nodes handed to 'make' and reused are not counted.
+def counting_builder(make: NodeBuilder, counter: List[int]) -> NodeBuilder:
+    def build(v: Value, l: BinTree, r: BinTree, k: Any = None) -> Node:
+        node : Node = make(v, l, r, k)
+        reused : set = {id(l), id(r)}
+        for child in (l, r):
+            if child is not None:
+                reused.update((id(child.left), id(child.right)))
+        counter[0] += 1 + sum(1 for child in (node.left, node.right)
+                              if child is not None and id(child) not in reused)
+        return node
+    return build
+
+# Add one operation's costs to 'op'.
+def record(op: OpStats, comparisons: int, path_length: int,
+           nodes_visited: int, allocations: int) -> None:
+    op.calls += 1
+    op.comparisons += comparisons
+    op.nodes_visited += nodes_visited
+    op.allocations += allocations
+    op.path_lengths[path_length] = op.path_lengths.get(path_length, 0) + 1
+
+# insert, lookup and delete for a BST with stats. They follow the plain
+# versions step for step, through the counting view and builder.
+def instrumented_insert(BST: bst, value: Value) -> bst:
+    assert BST.stats is not None
+    comparisons : List[int] = [0]
+    allocations : List[int] = [0]
+    make : NodeBuilder = counting_builder(node_builder(BST.balance), allocations)
+    if BST.balance == "randomized":
+        new_tree, visited = randomized_insert_tree(counting_view(BST, comparisons), value, make)
+        record(BST.stats.insert, comparisons[0], visited, visited, allocations[0])
+        return BST if new_tree is None else with_tree(BST, new_tree)
+    path, tree = find_path(counting_view(BST, comparisons), value)
+    path_length : int = len(path) + (tree is not None)
+    result : bst = BST
+    if tree is None:
+        leaf : Node = Node(value, None, None, node_key(BST, value))
+        allocations[0] += 1
+        result = with_tree(BST, rebuild_path(path, leaf, make))
+    record(BST.stats.insert, comparisons[0], path_length, path_length, allocations[0])
+    return result
+
+def instrumented_lookup(BST: bst, value: Value) -> bool:
+    assert BST.stats is not None
+    comparisons : List[int] = [0]
+    path, tree = find_path(counting_view(BST, comparisons), value)
+    path_length : int = len(path) + (tree is not None)
+    record(BST.stats.lookup, comparisons[0], path_length, path_length, 0)
+    return tree is not None
+
+def instrumented_delete(BST: bst, value: Value) -> bst:
+    assert BST.stats is not None
+    comparisons : List[int] = [0]
+    allocations : List[int] = [0]
+    path, tree = find_path(counting_view(BST, comparisons), value)
+    path_length : int = len(path) + (tree is not None)
+    nodes_visited : int = path_length
+    result : bst = BST
+    if tree is not None:
+        make : NodeBuilder = counting_builder(node_builder(BST.balance), allocations)
+        subtree : BinTree = remove_root(BST.balance, tree, make, BST.rng)
+        if BST.balance == "randomized":
+            # random_concat visits one node per node it allocates
+            nodes_visited += allocations[0]
+        else:
+            # delete_root walks the left subtree's right spine
+            spine : BinTree = tree.left
+            while spine is not None:
+                nodes_visited += 1
+                spine = spine.right
+        result = with_tree(BST, rebuild_path(path, subtree, make))
+    record(BST.stats.delete, comparisons[0], path_length, nodes_visited, allocations[0])
+    return result
+
+# Returns the mean of a path length histogram, 0.0 if it is empty.
+def mean_path_length(op: OpStats) -> float:
+    if op.calls == 0:
+        return 0.0
+    return sum(length * count for length, count in op.path_lengths.items()) / op.calls
+
+# Returns 'stats' as a flat name -> number mapping for a metrics system,
+# e.g. 'insert.allocations_per_op'. 'max_path_length' is the one to
+# alert on: it grows towards n as a tree degenerates, against log2(n)
+# for a balanced one.
+def stats_metrics(stats: TreeStats) -> Dict[str, float]:
+    metrics : Dict[str, float] = {}
+    for name, op in (("insert", stats.insert), ("lookup", stats.lookup), ("delete", stats.delete)):
+        calls : int = max(op.calls, 1)
+        metrics[f"{name}.calls"] = op.calls
+        metrics[f"{name}.comparisons_per_op"] = op.comparisons / calls
+        metrics[f"{name}.nodes_visited_per_op"] = op.nodes_visited / calls
+        metrics[f"{name}.allocations_per_op"] = op.allocations / calls
+        metrics[f"{name}.mean_path_length"] = mean_path_length(op)
+        metrics[f"{name}.max_path_length"] = max(op.path_lengths, default=0)
+    return metrics
+
+# Returns a cmp-style comparator on values that follows the order of
+# 'BST'. Meant for code outside the per-level hot loops.
+def three_way(BST: bst) -> ThreeWayComparator:
+    if BST.compare is not None:
+        return BST.compare
+    if BST.key is not None:
+        key : KeyFunction = BST.key
+        def compare_keys(a: Value, b: Value) -> int:
+            ka, kb = key(a), key(b)
+            return -1 if ka < kb else (1 if kb < ka else 0)
+        return compare_keys
+    comes_before : Comparator = BST.comes_before
+    def compare_values(a: Value, b: Value) -> int:
+        if comes_before(a, b):
+            return -1
+        if comes_before(b, a):
+            return 1
+        return 0
+    return compare_values
+
+# Returns a function that compares 'value' with the value of a node of
+# 'BST', cmp-style. The key of 'value' is computed once, up front.
+def compare_to(BST: bst, value: Value) -> Callable[[Node], int]:
+    if BST.compare is not None:
+        compare : ThreeWayComparator = BST.compare
+        return lambda node: compare(value, node.value)
+    if BST.key is not None:
+        k : Any = BST.key(value)
+        return lambda node: -1 if k < node.key else (1 if node.key < k else 0)
+    comes_before : Comparator = BST.comes_before
+    def compare_values(node: Node) -> int:
+        if comes_before(value, node.value):
+            return -1
+        if comes_before(node.value, value):
+            return 1
+        return 0
+    return compare_values
+
+# Returns a function that compares the value of 'node' (a node of 'BST'
+# or of a BST with the same order) with the value of another node,
+# reusing the cached key of 'node'.
+def compare_node_to(BST: bst, node: Node) -> Callable[[Node], int]:
+    if BST.key is not None:
+        k : Any = node.key
+        return lambda other: -1 if k < other.key else (1 if other.key < k else 0)
+    return compare_to(BST, node.value)
+
+# Build a perfectly balanced tree from 'values' and their cached 'keys',
+# which are strictly increasing in the tree's order. Also a valid
+# weight-balanced tree.
+def build_balanced(values: Sequence[Value], keys: Sequence[Any]) -> BinTree:
+    def build(lo: int, hi: int) -> BinTree:
+        if lo >= hi:
+            return None
+        mid : int = (lo + hi) // 2
+        return Node(values[mid], build(lo, mid), build(mid + 1, hi), keys[mid])
+    return build(0, len(values))
+
+# Returns the sorted 'values' with runs of equal values reduced to their
+# first element, together with their cached keys ('keys' is None when
+# 'BST' has no key function, and the returned keys are then all None).
+# Raises ValueError if the values are out of order.
+def unique_sorted(BST: bst, values: Sequence[Value],
+                  keys: Optional[Sequence[Any]]) -> Tuple[List[Value], List[Any]]:
+    unique_values : List[Value] = []
+    unique_keys : List[Any] = []
+    if keys is not None:
+        for value, k in zip(values, keys):
+            if unique_keys and not unique_keys[-1] < k:
+                if k < unique_keys[-1]:
+                    raise ValueError("values are not sorted.")
+                continue
+            unique_values.append(value)
+            unique_keys.append(k)
+    else:
+        order : ThreeWayComparator = three_way(BST)
+        for value in values:
+            if unique_values:
+                c : int = order(unique_values[-1], value)
+                if c > 0:
+                    raise ValueError("values are not sorted.")
+                if c == 0:
+                    continue
+            unique_values.append(value)
+        unique_keys = [None] * len(unique_values)
+    return unique_values, unique_keys
+
+# Sort 'values' in the order of 'BST' and drop duplicates, keeping the
+# earliest of several equal values. Returns the values and their keys as
+# for unique_sorted; the key function runs once per value.
+def sort_unique(BST: bst, values: Iterable[Value]) -> Tuple[List[Value], List[Any]]:
+    items : List[Value] = list(values)
+    if BST.key is None:
+        # list.sort is stable, so equal values keep their input order
+        items.sort(key=cmp_to_key(three_way(BST)))
+        return unique_sorted(BST, items, None)
+    keys : List[Any] = [BST.key(value) for value in items]
+    positions : List[int] = sorted(range(len(items)), key=keys.__getitem__)
+    return unique_sorted(BST, [items[i] for i in positions], [keys[i] for i in positions])
+
+# Returns the BST holding 'values', which must already be in the order
+# given by the ordering options. Runs of equal values keep their first
+# element. Builds a perfectly balanced tree in O(n); raises ValueError
+# if 'values' is out of order.
+def from_sorted(comes_before: Comparator, values: Iterable[Value],
+                balance: BalanceMode = "none",
+                compare: Optional[ThreeWayComparator] = None,
+                key: Optional[KeyFunction] = None) -> bst:
+    BST : bst = BinarySearchTree(comes_before, None, balance, compare, key)
+    node_builder(balance)  # reject unknown balance modes up front
+    items : List[Value] = list(values)
+    keys : Optional[List[Any]] = None if key is None else [key(value) for value in items]
+    return with_tree(BST, build_balanced(*unique_sorted(BST, items, keys)))
+
+# Returns the BST holding 'values' in any order, as if each had been
+# inserted in turn (so the first of several equal values is kept), but
+# sorting once and building a perfectly balanced tree instead of copying
+# a root-to-leaf path per value. O(n log n). Given a 'typecode' from
+# DENSE_TYPECODES, the tree is built as a DenseBST instead; that needs
+# default_comparator and no balancing, compare or key (ValueError
+# otherwise).
+@overload
+def from_iterable(comes_before: Comparator, values: Iterable[Value],
+                  balance: BalanceMode = "none",
+                  compare: Optional[ThreeWayComparator] = None,
+                  key: Optional[KeyFunction] = None,
+                  typecode: None = None) -> bst: ...
+@overload
+def from_iterable(comes_before: Comparator, values: Iterable[Value],
+                  balance: BalanceMode = "none",
+                  compare: Optional[ThreeWayComparator] = None,
+                  key: Optional[KeyFunction] = None,
+                  *, typecode: str) -> 'DenseBST': ...
+def from_iterable(comes_before: Comparator, values: Iterable[Value],
+                  balance: BalanceMode = "none",
+                  compare: Optional[ThreeWayComparator] = None,
+                  key: Optional[KeyFunction] = None,
+                  typecode: Optional[str] = None) -> Union[bst, 'DenseBST']:
+    if typecode is not None:
+        if (comes_before is not default_comparator or balance != "none"
+                or compare is not None or key is not None):
+            raise ValueError("dense trees need default_comparator, balance 'none' and no compare or key.")
+        return dense_from_iterable(values, typecode)
+    BST : bst = BinarySearchTree(comes_before, None, balance, compare, key)
+    node_builder(balance)  # reject unknown balance modes up front
+    return with_tree(BST, build_balanced(*sort_unique(BST, values)))
+
+# Join the trees 'l' and 'r' with the value 'v' (cached key 'k') between
+# them: everything in 'l' comes before 'v' and everything in 'r' after.
+# The two sides may differ in size arbitrarily; in weight mode the result
+# is rebalanced, descending the heavier side's spine, in O(log n).
+def link(balance: BalanceMode, v: Value, l: BinTree, r: BinTree, k: Any = None,
+         rng: Any = random) -> Node:
+    if balance == "none":
+        return Node(v, l, r, k)
+    if balance == "randomized":
+        return random_link(v, l, r, k, rng)
+    node_builder(balance)  # reject unknown balance modes
+    left_weight : int = tree_size(l) + 1
+    right_weight : int = tree_size(r) + 1
+    if right_weight > DELTA * left_weight:
+        assert r is not None
+        return balance_node(r.value, link(balance, v, l, r.left, k, rng), r.right, r.key)
+    if left_weight > DELTA * right_weight:
+        assert l is not None
+        return balance_node(l.value, l.left, link(balance, v, l.right, r, k, rng), l.key)
+    return Node(v, l, r, k)
+
+# Join the trees 'l' and 'r', where everything in 'l' comes before
+# everything in 'r'. In plain mode the largest value of 'l' becomes the
+# new root, as in delete_root.
+def concat(balance: BalanceMode, l: BinTree, r: BinTree, rng: Any = random) -> BinTree:
+    if l is None:
+        return r
+    if r is None:
+        return l
+    if balance == "none":
+        left_max : Node = largest_node(l)
+        return Node(left_max.value, delete_largest_value(l), r, left_max.key)
+    if balance == "randomized":
+        return random_concat(l, r, Node, rng)
+    left_weight : int = tree_size(l) + 1
+    right_weight : int = tree_size(r) + 1
+    if right_weight > DELTA * left_weight:
+        return balance_node(r.value, concat(balance, l, r.left, rng), r.right, r.key)
+    if left_weight > DELTA * right_weight:
+        return balance_node(l.value, l.left, concat(balance, l.right, r, rng), l.key)
+    left_max = largest_node(l)
+    return balance_node(left_max.value, delete_largest_value(l, balance_node), r, left_max.key)
+
+# A randomized BST holding n values has each of them at its root with
+# probability 1/n, and its subtrees are randomized BSTs in turn. The
+# functions below keep that up using the sizes the nodes already hold and
+# a random generator 'rng' (the BST's), so no per-node priorities are
+# stored.
+
+# Join the randomized BSTs 'l' and 'r', where everything in 'l' comes
+# before everything in 'r', into a randomized BST: the root is taken from
+# 'l' with probability |l| / (|l| + |r|), and so on down. Expected
+# O(log n) nodes are rebuilt with 'make'.
+def random_concat(l: BinTree, r: BinTree, make: NodeBuilder = Node,
+                  rng: Any = random) -> BinTree:
+    path : Path = []
+    while l is not None and r is not None:
+        if rng.random() * (l.size + r.size) < l.size:
+            path.append((l, False))
+            l = l.right
+        else:
+            path.append((r, True))
+            r = r.left
+    return rebuild_path(path, r if l is None else l, make)
+
+# link for randomized BSTs: 'v' becomes the root with probability
+# 1 / (|l| + |r| + 1), otherwise the root of 'l' or 'r' does, and so on.
+def random_link(v: Value, l: BinTree, r: BinTree, k: Any = None, rng: Any = random) -> Node:
+    path : Path = []
+    while True:
+        left_size : int = tree_size(l)
+        right_size : int = tree_size(r)
+        pick : float = rng.random() * (left_size + right_size + 1)
+        if pick < left_size:
+            assert l is not None
+            path.append((l, False))
+            l = l.right
+        elif pick < left_size + right_size:
+            assert r is not None
+            path.append((r, True))
+            r = r.left
+        else:
+            break
+    root : BinTree = rebuild_path(path, Node(v, l, r, k), Node)
+    assert root is not None
+    return root
+
+# Insert 'value' into the randomized 'BST', rebuilding nodes with 'make'.
+# The new value becomes the root of a subtree of size m with probability
+# 1 / (m + 1): the descent stops there and the subtree is split around
+# the value. Returns the new tree, or None if 'value' is already present,
+# and the number of nodes visited.
+def randomized_insert_tree(BST: bst, value: Value, make: NodeBuilder) -> Tuple[BinTree, int]:
+    order : Callable[[Node], int] = compare_to(BST, value)
+    path : Path = []
+    tree : BinTree = BST.tree
+    visited : int = 0
+    draw : Callable[[], float] = BST.rng.random
+    while tree is not None and draw() * (tree.size + 1) >= 1.0:
+        visited += 1
+        c : int = order(tree)
+        if c == 0:
+            return None, visited
+        path.append((tree, c < 0))
+        tree = tree.left if c < 0 else tree.right
+    # Split what is left around 'value': nodes before it are chained
+    # through their right links, nodes after it through their left links
+    before : Path = []
+    after : Path = []
+    while tree is not None:
+        visited += 1
+        c = order(tree)
+        if c == 0:
+            return None, visited
+        if c < 0:
+            after.append((tree, True))
+            tree = tree.left
+        else:
+            before.append((tree, False))
+            tree = tree.right
+    root : Node = make(value, rebuild_path(before, None, make),
+                       rebuild_path(after, None, make), node_key(BST, value))
+    return rebuild_path(path, root, make), visited
+
+# Returns a function locating 'node' within the sorted batch 'values'
+# (with cached 'keys'): given a slice [lo, hi) it returns the index of
+# the first batch value not before 'node', and whether that value equals
+# 'node'. Uses binary search, so O(log k) comparisons per node.
+def batch_locator(BST: bst, values: Sequence[Value],
+                  keys: Sequence[Any]) -> Callable[[Node, int, int], Tuple[int, bool]]:
+    order : ThreeWayComparator = three_way(BST)
+    by_key : bool = BST.key is not None
+    def locate(node: Node, lo: int, hi: int) -> Tuple[int, bool]:
+        node_value : Value = node.key if by_key else node.value
+        end : int = hi
+        while lo < hi:
+            mid : int = (lo + hi) // 2
+            if by_key:
+                before : bool = keys[mid] < node_value
+            else:
+                before = order(values[mid], node_value) < 0
+            if before:
+                lo = mid + 1
             else:
-                left_max: Value = largest_value(l)
-                new_left_subtree: BinTree = delete_largest_value(l)
-                return Node(left_max, new_left_subtree, r)
+                hi = mid
+        if lo == end:
+            return lo, False
+        if by_key:
+            return lo, not node_value < keys[lo]
+        return lo, order(values[lo], node_value) == 0
+    return locate
+
+# Insert every value in 'values' into 'BST', returning the new BST. The
+# batch is sorted once and merged into the tree in a single pass, so a
+# node shared by the paths of several new values is copied once per
+# batch instead of once per value. Subtrees the batch does not reach are
+# shared with 'BST'. Values already present (or repeated in the batch)
+# are skipped, keeping the earliest, as with insert.
+@overload
+def insert_many(BST: bst, values: Iterable[Value]) -> bst: ...
+@overload
+def insert_many(BST: 'DenseBST', values: Iterable[Value]) -> 'DenseBST': ...
+def insert_many(BST: Any, values: Iterable[Value]) -> Any:
+    if type(BST) is DenseBST:
+        for value in values:
+            BST = dense_insert(BST, value)
+        return BST
+    batch, keys = sort_unique(BST, values)
+    locate = batch_locator(BST, batch, keys)
+    balance : BalanceMode = BST.balance
+    rng : Any = BST.rng
+    
+    def merge(tree: BinTree, lo: int, hi: int) -> BinTree:
+        if lo >= hi:
+            return tree
+        if tree is None:
+            return build_balanced(batch[lo:hi], keys[lo:hi])
+        mid, found = locate(tree, lo, hi)
+        right_lo : int = mid + 1 if found else mid
+        # skip the call for children the batch does not reach
+        new_left : BinTree = merge(tree.left, lo, mid) if lo < mid else tree.left
+        new_right : BinTree = merge(tree.right, right_lo, hi) if right_lo < hi else tree.right
+        if new_left is tree.left and new_right is tree.right:
+            return tree
+        return link(balance, tree.value, new_left, new_right, tree.key, rng)
+    
+    with recursion_depth(height_bound(BST)):
+        new_tree : BinTree = merge(BST.tree, 0, len(batch))
+    if new_tree is BST.tree:
+        return BST
+    return with_tree(BST, new_tree)
 
-# Delete 'value' from 'BST' (if present)
-def delete(BST: bst, value: Value) -> bst:
-    value_present = lookup(BST, value)
+# Delete every value in 'values' from 'BST' (those present), returning
+# the new BST, in one pass over the tree as for insert_many.
+@overload
+def delete_many(BST: bst, values: Iterable[Value]) -> bst: ...
+@overload
+def delete_many(BST: 'DenseBST', values: Iterable[Value]) -> 'DenseBST': ...
+def delete_many(BST: Any, values: Iterable[Value]) -> Any:
+    if type(BST) is DenseBST:
+        for value in values:
+            BST = dense_delete(BST, value)
+        return BST
+    batch, keys = sort_unique(BST, values)
+    locate = batch_locator(BST, batch, keys)
+    balance : BalanceMode = BST.balance
+    rng : Any = BST.rng
+    
+    def merge(tree: BinTree, lo: int, hi: int) -> BinTree:
+        if lo >= hi or tree is None:
+            return tree
+        mid, found = locate(tree, lo, hi)
+        right_lo : int = mid + 1 if found else mid
+        # skip the call for children the batch does not reach
+        new_left : BinTree = merge(tree.left, lo, mid) if lo < mid else tree.left
+        new_right : BinTree = merge(tree.right, right_lo, hi) if right_lo < hi else tree.right
+        if found:
+            return concat(balance, new_left, new_right, rng)
+        if new_left is tree.left and new_right is tree.right:
+            return tree
+        return link(balance, tree.value, new_left, new_right, tree.key, rng)
     
-    if value_present is False:
+    with recursion_depth(height_bound(BST)):
+        new_tree : BinTree = merge(BST.tree, 0, len(batch))
+    if new_tree is BST.tree:
         return BST
+    return with_tree(BST, new_tree)
+
+# Memory used by the nodes of a tree, excluding the values themselves.
+@dataclass(frozen=True)
+class MemoryFootprint:
+    nodes: int
+    node_bytes: int
+    bytes_per_node: float
+
+# Returns the memory taken by the nodes of 'BST' (their own objects plus
+# any per-instance __dict__), not counting the values they hold.
+def memory_footprint(BST: bst) -> MemoryFootprint:
+    require_nodes(BST, "memory_footprint")
+    nodes : int = 0
+    node_bytes : int = 0
+    stack : List[BinTree] = [BST.tree]
+    while stack:
+        tree : BinTree = stack.pop()
+        if tree is None:
+            continue
+        nodes += 1
+        node_bytes += sys.getsizeof(tree)
+        instance_dict : Optional[dict] = getattr(tree, '__dict__', None)
+        if instance_dict is not None:
+            node_bytes += sys.getsizeof(instance_dict)
+        stack.append(tree.left)
+        stack.append(tree.right)
+    return MemoryFootprint(nodes, node_bytes, node_bytes / nodes if nodes else 0.0)
+
+# Returns the 'k'-th smallest value of 'BST', counting from 0, in
+# O(height). Raises IndexError if 'k' is not in range(len(BST)).
+def select(BST: bst, k: int) -> Value:
+    require_nodes(BST, "select")
+    if not 0 <= k < len(BST):
+        raise IndexError("select index out of range.")
+    tree : BinTree = BST.tree
+    while tree is not None:
+        left_size : int = tree_size(tree.left)
+        if k < left_size:
+            tree = tree.left
+        elif k > left_size:
+            k -= left_size + 1
+            tree = tree.right
+        else:
+            return tree.value
+    raise AssertionError("subtree sizes are inconsistent.")
+
+# Returns the number of values in 'BST' that come before 'value' (or
+# that are equal to it too, if 'inclusive'), in O(height).
+def count_before(BST: bst, value: Value, inclusive: bool = False) -> int:
+    require_nodes(BST, "count_before")
+    order : Callable[[Node], int] = compare_to(BST, value)
+    count : int = 0
+    tree : BinTree = BST.tree
+    while tree is not None:
+        c : int = order(tree)
+        if c < 0:
+            tree = tree.left
+        elif c > 0:
+            count += tree_size(tree.left) + 1
+            tree = tree.right
+        else:
+            count += tree_size(tree.left)
+            return count + 1 if inclusive else count
+    return count
+
+# Returns the rank of 'value' in 'BST': the number of values that come
+# before it, which is its index if it is present. O(height).
+def rank(BST: bst, value: Value) -> int:
+    return count_before(BST, value)
+
+# Returns the number of values 'v' in 'BST' with lo <= v <= hi, in
+# O(height).
+def count_range(BST: bst, lo: Value, hi: Value) -> int:
+    return max(0, count_before(BST, hi, inclusive=True) - count_before(BST, lo))
+
+# Yield the values of 'BST' in order. Lazy, driven by an explicit stack
+# of O(height) nodes; since trees are never modified, the iterator keeps
+# walking the version it was created from even as newer ones are made.
+def iter_inorder(BST: Union[bst, 'DenseBST']) -> Iterator[Value]:
+    if isinstance(BST, DenseBST):
+        yield from dense_iter(BST)
+        return
+    stack : List[Node] = []
+    tree : BinTree = BST.tree
+    while stack or tree is not None:
+        while tree is not None:
+            stack.append(tree)
+            tree = tree.left
+        node : Node = stack.pop()
+        yield node.value
+        tree = node.right
+
+# Yield the values of 'BST' in reverse order, as for iter_inorder.
+def iter_reversed(BST: Union[bst, 'DenseBST']) -> Iterator[Value]:
+    if isinstance(BST, DenseBST):
+        yield from dense_iter(BST, reverse=True)
+        return
+    stack : List[Node] = []
+    tree : BinTree = BST.tree
+    while stack or tree is not None:
+        while tree is not None:
+            stack.append(tree)
+            tree = tree.right
+        node : Node = stack.pop()
+        yield node.value
+        tree = node.left
+
+# Yield, in order, the values 'v' of 'BST' with lo <= v <= hi. Subtrees
+# entirely outside the range are never visited, so producing k values
+# costs O(height + k); memory is O(height).
+def range_query(BST: Union[bst, 'DenseBST'], lo: Value, hi: Value) -> Iterator[Value]:
+    if isinstance(BST, DenseBST):
+        yield from dense_range_query(BST, lo, hi)
+        return
+    compare_lo : Callable[[Node], int] = compare_to(BST, lo)
+    compare_hi : Callable[[Node], int] = compare_to(BST, hi)
     
-    comes_before = BST.comes_before
-    tree = BST.tree
-    
-    # Helper function to recursively delete the value
-    def delete_helper(currentTree: BinTree, v: Value) -> BinTree:
-        match currentTree:
-            case None:
-                return None
-            case Node(root_v, l, r):
-                is_less = comes_before(v, currentTree.value)
-                is_greater = comes_before(currentTree.value, v)
-                
-                if is_less:
-                    return Node(root_v, delete_helper(l, value), r)
-                elif is_greater:
-                    return Node(root_v, l, delete_helper(r, value))
-                else:
-                    # found the value
-                    return delete_root(currentTree)
-    
-    return BinarySearchTree(comes_before, delete_helper(tree, value))
\ No newline at end of file
+    # stack the nodes at or after 'lo' on the path to it; the top is the
+    # smallest value in range (if any)
+    stack : List[Node] = []
+    tree : BinTree = BST.tree
+    while tree is not None:
+        if compare_lo(tree) <= 0:
+            stack.append(tree)
+            tree = tree.left
+        else:
+            tree = tree.right
+    
+    while stack:
+        node : Node = stack.pop()
+        if compare_hi(node) < 0:
+            return
+        yield node.value
+        tree = node.right
+        while tree is not None:
+            stack.append(tree)
+            tree = tree.left
+
+# Raise ValueError unless 'a' and 'b' order and balance their values the
+# same way, as the set operations below require.
+def check_same_order(a: bst, b: bst) -> None:
+    require_nodes(a, "set operations")
+    require_nodes(b, "set operations")
+    if (a.comes_before is not b.comes_before or a.compare is not b.compare
+            or a.key is not b.key or a.balance != b.balance):
+        raise ValueError("trees have different ordering or balance options.")
+
+# Split 'tree' around the value 'order' compares nodes with. Returns the
+# subtree of values before it, the node equal to it (or None) and the
+# subtree of values after it. Untouched subtrees are shared; O(height),
+# with the path kept in a list rather than on the call stack.
+def split_tree(balance: BalanceMode, tree: BinTree,
+               order: Callable[[Node], int]) -> Tuple[BinTree, BinTree, BinTree]:
+    if balance == "randomized":
+        # the pieces of a split randomized BST are randomized as they are
+        balance = "none"
+    path : List[Tuple[Node, int]] = []
+    found : BinTree = None
+    while tree is not None:
+        c : int = order(tree)
+        if c == 0:
+            found = tree
+            break
+        path.append((tree, c))
+        tree = tree.left if c < 0 else tree.right
+    l : BinTree = None if found is None else found.left
+    r : BinTree = None if found is None else found.right
+    # bottom-up, each node on the path joins the piece on its side
+    for node, c in reversed(path):
+        if c < 0:
+            r = link(balance, node.value, r, node.right, node.key)
+        else:
+            l = link(balance, node.value, node.left, l, node.key)
+    return l, found, r
+
+# Split 'BST' around 'pivot'. Returns the BST of values before 'pivot',
+# whether 'pivot' was present, and the BST of values after it.
+def split(BST: bst, pivot: Value) -> Tuple[bst, bool, bst]:
+    require_nodes(BST, "split")
+    l, found, r = split_tree(BST.balance, BST.tree, compare_to(BST, pivot))
+    return with_tree(BST, l), found is not None, with_tree(BST, r)
+
+# Join 'left' and 'right', where every value of 'left' comes before every
+# value of 'right'; raises ValueError otherwise. O(log n) when balanced.
+def join(left: bst, right: bst) -> bst:
+    check_same_order(left, right)
+    left_tree : BinTree = left.tree
+    right_tree : BinTree = right.tree
+    if left_tree is not None and right_tree is not None:
+        smallest_right : Node = right_tree
+        while smallest_right.left is not None:
+            smallest_right = smallest_right.left
+        if compare_node_to(left, largest_node(left_tree))(smallest_right) >= 0:
+            raise ValueError("values of 'left' must all come before those of 'right'.")
+    return with_tree(left, concat(left.balance, left.tree, right.tree, left.rng))
+
+# Returns the BST of values in 'a' or 'b'; of two equal values the one
+# from 'a' is kept. Subtrees of 'a' that gain nothing are shared, and
+# for balanced trees of sizes m <= n the work is O(m log(n/m + 1)).
+def union(a: bst, b: bst) -> bst:
+    check_same_order(a, b)
+    balance : BalanceMode = a.balance
+    rng : Any = a.rng
+    
+    def union_trees(t1: BinTree, t2: BinTree) -> BinTree:
+        if t1 is None:
+            return t2
+        if t2 is None:
+            return t1
+        l, _, r = split_tree(balance, t2, compare_node_to(a, t1))
+        new_left : BinTree = union_trees(t1.left, l)
+        new_right : BinTree = union_trees(t1.right, r)
+        if new_left is t1.left and new_right is t1.right:
+            return t1
+        return link(balance, t1.value, new_left, new_right, t1.key, rng)
+    
+    with recursion_depth(height_bound(a) + height_bound(b)):
+        return with_tree(a, union_trees(a.tree, b.tree))
+
+# Returns the BST of values of 'a' that are also in 'b' (the values kept
+# are those of 'a'). Same bounds as union.
+def intersection(a: bst, b: bst) -> bst:
+    check_same_order(a, b)
+    balance : BalanceMode = a.balance
+    rng : Any = a.rng
+    
+    def intersect_trees(t1: BinTree, t2: BinTree) -> BinTree:
+        if t1 is None or t2 is None:
+            return None
+        l, found, r = split_tree(balance, t2, compare_node_to(a, t1))
+        new_left : BinTree = intersect_trees(t1.left, l)
+        new_right : BinTree = intersect_trees(t1.right, r)
+        if found is None:
+            return concat(balance, new_left, new_right, rng)
+        if new_left is t1.left and new_right is t1.right:
+            return t1
+        return link(balance, t1.value, new_left, new_right, t1.key, rng)
+    
+    with recursion_depth(height_bound(a) + height_bound(b)):
+        return with_tree(a, intersect_trees(a.tree, b.tree))
+
+# Returns the BST of values of 'a' that are not in 'b'. Same bounds as
+# union.
+def difference(a: bst, b: bst) -> bst:
+    check_same_order(a, b)
+    balance : BalanceMode = a.balance
+    rng : Any = a.rng
+    
+    def difference_trees(t1: BinTree, t2: BinTree) -> BinTree:
+        if t1 is None or t2 is None:
+            return t1
+        l, found, r = split_tree(balance, t2, compare_node_to(a, t1))
+        new_left : BinTree = difference_trees(t1.left, l)
+        new_right : BinTree = difference_trees(t1.right, r)
+        if found is not None:
+            return concat(balance, new_left, new_right, rng)
+        if new_left is t1.left and new_right is t1.right:
+            return t1
+        return link(balance, t1.value, new_left, new_right, t1.key, rng)
+    
+    with recursion_depth(height_bound(a) + height_bound(b)):
+        return with_tree(a, difference_trees(a.tree, b.tree))
+
+# Permute 'values' (sorted) into Eytzinger order: the breadth-first layout
+# of a complete binary search tree, where the children of position i are
+# 2i+1 and 2i+2. Searches then touch memory roughly front to back.
+def eytzinger_order(values: Sequence[Value]) -> List[Value]:
+    n : int = len(values)
+    out : List[Value] = [None] * n
+    position : int = 0
+    stack : List[int] = []
+    i : int = 0
+    while stack or i < n:
+        while i < n:
+            stack.append(i)
+            i = 2 * i + 1
+        i = stack.pop()
+        out[i] = values[position]
+        position += 1
+        i = 2 * i + 2
+    return out
+
+# Returns the in-order successor of position 'i' in an Eytzinger array of
+# 'n' elements, or -1 if 'i' holds the largest value.
+def eytzinger_successor(i: int, n: int) -> int:
+    j : int = 2 * i + 2
+    if j < n:
+        while 2 * j + 1 < n:
+            j = 2 * j + 1
+        return j
+    # climb while 'i' is a right child (right children sit at even positions)
+    while i > 0 and i % 2 == 0:
+        i = (i - 2) // 2
+    if i == 0:
+        return -1
+    return (i - 1) // 2
+
+# On-disk snapshot layout: a fixed header followed by the values as
+# native fixed-width numbers ('q' for int64, 'd' for float64) in
+# Eytzinger order.
+SNAPSHOT_MAGIC : bytes = b"BSTSNAP1"
+SNAPSHOT_HEADER : struct.Struct = struct.Struct("=8sc7xQ")
+
+# Read-only view of a snapshot file written by save. 'keys' is a memoryview
+# of the memory-mapped values in Eytzinger order; nothing is deserialized
+# into Node objects. Use as a context manager, or close() it, to unmap.
+@dataclass(frozen=True)
+class Snapshot:
+    path: str
+    typecode: str
+    keys: memoryview
+    buffer: mmap.mmap
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def close(self) -> None:
+        self.keys.release()
+        self.buffer.close()
+
+    def __enter__(self) -> 'Snapshot':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+# Write 'BST' to 'path' as a snapshot that load can memory-map. Only
+# fixed-width keys are supported: every value must be an int fitting in
+# 64 bits, or a number exactly representable as a float, and the BST must
+# be ordered like '<' on them. Raises TypeError/ValueError otherwise.
+def save(BST: bst, path: str) -> None:
+    values : List[Value] = list(iter_inorder(BST))
+    if all(type(v) is int for v in values):
+        typecode : str = 'q'
+    elif all(type(v) in (int, float) and float(v) == v for v in values):
+        typecode = 'd'
+        values = [float(v) for v in values]
+    else:
+        raise TypeError("snapshots need int or float values.")
+    for previous, current in zip(values, values[1:]):
+        if not previous < current:
+            raise ValueError("snapshots need trees ordered by '<'.")
+    try:
+        data : array = array(typecode, eytzinger_order(values))
+    except OverflowError:
+        raise ValueError("snapshot int values must fit in 64 bits.") from None
+    with open(path, "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, typecode.encode(), len(values)))
+        data.tofile(f)
+
+# Memory-map the snapshot at 'path' read-only. Lookups and range queries
+# read the mapped pages directly, so start-up costs no parsing and the
+# pages are shared between processes mapping the same file.
+def load(path: str) -> Snapshot:
+    with open(path, "rb") as f:
+        size : int = os.fstat(f.fileno()).st_size
+        if size < SNAPSHOT_HEADER.size:
+            raise ValueError(f"{path} is not a BST snapshot.")
+        buffer : mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, typecode, count = SNAPSHOT_HEADER.unpack_from(buffer)
+    if magic != SNAPSHOT_MAGIC or typecode not in (b'q', b'd'):
+        buffer.close()
+        raise ValueError(f"{path} is not a BST snapshot.")
+    end : int = SNAPSHOT_HEADER.size + count * 8
+    if end != size:
+        buffer.close()
+        raise ValueError(f"{path} is truncated.")
+    keys : memoryview = memoryview(buffer)[SNAPSHOT_HEADER.size:end].cast(typecode.decode())
+    return Snapshot(path, typecode.decode(), keys, buffer)
+
+# Returns True if 'value' is in 'snapshot', False otherwise. O(log n).
+def snapshot_lookup(snapshot: Snapshot, value: Value) -> bool:
+    keys : memoryview = snapshot.keys
+    n : int = len(keys)
+    i : int = 0
+    while i < n:
+        k : Value = keys[i]
+        if value < k:
+            i = 2 * i + 1
+        elif k < value:
+            i = 2 * i + 2
+        else:
+            return True
+    return False
+
+# Yield, in order, the values 'v' of 'snapshot' with lo <= v <= hi, in
+# O(log n + k).
+def snapshot_range_query(snapshot: Snapshot, lo: Value, hi: Value) -> Iterator[Value]:
+    keys : memoryview = snapshot.keys
+    n : int = len(keys)
+    # position of the smallest value >= lo, if any
+    first : int = -1
+    i : int = 0
+    while i < n:
+        if keys[i] < lo:
+            i = 2 * i + 2
+        else:
+            first = i
+            i = 2 * i + 1
+    i = first
+    while i != -1:
+        k : Value = keys[i]
+        if hi < k:
+            return
+        yield k
+        i = eytzinger_successor(i, n)
+
+# Deserialize 'snapshot' into a BST ordered by 'comes_before' (which must
+# agree with '<'), built balanced in O(n).
+def snapshot_to_bst(snapshot: Snapshot, comes_before: Comparator,
+                    balance: BalanceMode = "none") -> bst:
+    values : Iterator[Value] = snapshot_range_query(snapshot, -math.inf, math.inf)
+    return from_sorted(comes_before, values, balance)
+
+# One difference between two versions of a BST: 'value' was added (True)
+# or removed (False).
+class Change(NamedTuple):
+    added: bool
+    value: Value
+
+# Yield the values added to and removed from 'old' to give 'new', in
+# order. Subtrees the two versions share (the same Node objects, as left
+# behind by insert/delete path copying) are skipped by identity without
+# being visited, so versions a few updates apart are compared in about
+# O(changes * log n) rather than O(n). Driven by an explicit stack, as
+# iter_inorder is, so tall plain trees need no deep recursion. Mismatched
+# trees are refused on the call, not on the first next().
+def diff(old: bst, new: bst) -> Iterator[Change]:
+    check_same_order(old, new)
+    return diff_trees(old, new)
+
+# The generator behind diff, for trees already checked to match.
+def diff_trees(old: bst, new: bst) -> Iterator[Change]:
+    balance : BalanceMode = new.balance
+    # pairs of subtrees (old, new) still to compare, and removals of
+    # old roots, waiting in order
+    stack : List[Union[Tuple[BinTree, BinTree], Change]] = [(old.tree, new.tree)]
+    while stack:
+        item : Union[Tuple[BinTree, BinTree], Change] = stack.pop()
+        if isinstance(item, Change):
+            yield item
+            continue
+        a, b = item
+        if a is b:
+            continue
+        if a is None:
+            for value in iter_inorder(with_tree(new, b)):
+                yield Change(True, value)
+            continue
+        if b is None:
+            for value in iter_inorder(with_tree(old, a)):
+                yield Change(False, value)
+            continue
+        # 'b' split around a's root is free when both roots hold the same
+        # value, the usual case between nearby versions
+        b_left, found, b_right = split_tree(balance, b, compare_node_to(old, a))
+        stack.append((a.right, b_right))
+        if found is None:
+            stack.append(Change(False, a.value))
+        stack.append((a.left, b_left))
+
+# comes_before for values ordered by the standard '<'. Trees built with
+# it from numbers can use the dense engine below (see from_iterable).
+def default_comparator(x: Value, y: Value) -> bool:
+    return x < y
+
+# Array typecodes the dense engine stores values in: 'd' for floats,
+# 'q' for ints that fit in 64 bits.
+DENSE_TYPECODES : Tuple[str, ...] = ('d', 'q')
+
+# Nodes of a dense tree, kept in parallel arrays: node i holds keys[i]
+# and the indices of its children, -1 for none. The arena is append-only
+# and shared by every version derived from one tree, so path copying
+# appends nodes and old versions stay valid. Nodes no live version
+# reaches are reclaimed when an update compacts its result (see
+# DENSE_GROWTH) or dense_compact copies a version out.
+@dataclass(frozen=True)
+class DenseArena:
+    keys: array
+    left: array
+    right: array
+
+# A persistent BST of numbers ordered by '<', as a root index into an
+# arena. Made with dense_empty or from_iterable(..., typecode=...); the
+# dense_* functions are its own API. insert, lookup, delete, their _many
+# forms, is_empty, the iterators and range_query also accept it in place
+# of a BinarySearchTree with the same results; the rest raise TypeError
+# (see require_nodes) and need the node engine (see dense_to_bst). About
+# 16 bytes per node, against over 100 for a Node and its boxed number.
+# Versions sharing an arena must not be updated from several threads at
+# once.
+@dataclass(frozen=True, eq=False)
+class DenseBST:
+    arena: DenseArena
+    root: int
+    count: int
+    # nodes the updates leading to this version appended to the arena
+    # since it was built or compacted
+    appended: int = 0
+    # Never None: insert, lookup and delete test 'stats' before anything
+    # else, so dense trees take that branch and the node engine's path
+    # carries no extra type check.
+    stats: ClassVar[str] = "dense"
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def typecode(self) -> str:
+        return self.arena.keys.typecode
+
+# Raise TypeError if 'BST' is a DenseBST: its nodes keep no subtree sizes
+# and it has no ordering functions, so 'operation' needs the node engine.
+def require_nodes(BST: Any, operation: str) -> None:
+    if type(BST) is DenseBST:
+        raise TypeError(f"{operation} needs a BinarySearchTree; convert dense trees with dense_to_bst.")
+
+# Returns an empty dense tree storing values with array 'typecode'.
+def dense_empty(typecode: str = 'd') -> DenseBST:
+    if typecode not in DENSE_TYPECODES:
+        raise ValueError(f"dense trees need a typecode in {DENSE_TYPECODES}, not {typecode!r}")
+    return DenseBST(DenseArena(array(typecode), array('i'), array('i')), -1, 0)
+
+# Raise ValueError if 'value' would not be stored exactly under
+# 'typecode': a 'd' arena rounds ints beyond 2**53 to a nearby float,
+# which could then equal another key. save rejects the same values.
+def dense_check_exact(typecode: str, value: Value) -> None:
+    if typecode == 'd' and type(value) is not float and float(value) != value:
+        raise ValueError(f"{value!r} is not exactly representable as a float.")
+
+# Returns a dense tree holding 'values' (in any order; repeats are
+# dropped), perfectly balanced. Raises TypeError/OverflowError for values
+# the typecode cannot hold, ValueError for those it would round.
+def dense_from_iterable(values: Iterable[Value], typecode: str = 'd') -> DenseBST:
+    dense_empty(typecode)  # reject unknown typecodes up front
+    unique : List[Value] = sorted(set(values))
+    for value in unique:
+        dense_check_exact(typecode, value)
+    return dense_build(array(typecode, unique))
+
+# Returns a perfectly balanced dense tree in a fresh arena holding
+# 'items', which must be sorted and free of repeats. The keys are stored
+# in order, so node i holds items[i] and only the child indices need
+# filling in.
+def dense_build(items: array) -> DenseBST:
+    n : int = len(items)
+    left : array = array('i', [-1]) * n
+    right : array = array('i', [-1]) * n
+    ranges : List[Tuple[int, int]] = [(0, n)] if n else []
+    while ranges:
+        lo, hi = ranges.pop()
+        mid : int = (lo + hi) // 2
+        if lo < mid:
+            left[mid] = (lo + mid) // 2
+            ranges.append((lo, mid))
+        if mid + 1 < hi:
+            right[mid] = (mid + 1 + hi) // 2
+            ranges.append((mid + 1, hi))
+    return DenseBST(DenseArena(array(items.typecode, items), left, right), n // 2 if n else -1, n)
+
+# Once a line of updates has appended over DENSE_GROWTH times as many
+# nodes as its tree holds (and over DENSE_MIN_ARENA), the update compacts
+# its result into a fresh arena. The copies path copying leaves behind
+# are then reclaimed in amortized O(log n) per update, and a line of
+# updates keeps at most DENSE_GROWTH times its tree's nodes as garbage.
+# The count is per version, so each of many updates branching off one
+# old version appends a few nodes and compacts nothing. Older versions
+# keep the old arena, which is freed with the last of them.
+DENSE_GROWTH : int = 2
+DENSE_MIN_ARENA : int = 1024
+
+# Returns the version rooted at 'root' holding 'count' values, made by
+# updating 'D' and appending the nodes from index 'start' on, compacted
+# if its line of updates has appended too many.
+def dense_version(D: DenseBST, root: int, count: int, start: int) -> DenseBST:
+    appended : int = D.appended + len(D.arena.keys) - start
+    if appended > max(DENSE_GROWTH * count, DENSE_MIN_ARENA):
+        return dense_compact(DenseBST(D.arena, root, count))
+    return DenseBST(D.arena, root, count, appended)
+
+# Append copies of the nodes on 'path' (index, went left) to 'arena',
+# bottom-up around the node 'index'. Returns the index of the new root.
+def dense_rebuild(arena: DenseArena, path: List[Tuple[int, bool]], index: int) -> int:
+    keys, left, right = arena.keys, arena.left, arena.right
+    for node, went_left in reversed(path):
+        keys.append(keys[node])
+        if went_left:
+            left.append(index)
+            right.append(right[node])
+        else:
+            left.append(left[node])
+            right.append(index)
+        index = len(keys) - 1
+    return index
+
+# insert, lookup and delete on a dense tree, as for the node engine.
+def dense_insert(D: DenseBST, value: Value) -> DenseBST:
+    arena : DenseArena = D.arena
+    keys, left, right = arena.keys, arena.left, arena.right
+    path : List[Tuple[int, bool]] = []
+    i : int = D.root
+    while i >= 0:
+        k : Value = keys[i]
+        if value < k:
+            path.append((i, True))
+            i = left[i]
+        elif k < value:
+            path.append((i, False))
+            i = right[i]
+        else:
+            return D
+    dense_check_exact(keys.typecode, value)
+    start : int = len(keys)
+    keys.append(value)  # raises before anything is appended if it does not fit
+    left.append(-1)
+    right.append(-1)
+    return dense_version(D, dense_rebuild(arena, path, start), D.count + 1, start)
+
+def dense_lookup(D: DenseBST, value: Value) -> bool:
+    keys, left, right = D.arena.keys, D.arena.left, D.arena.right
+    i : int = D.root
+    while i >= 0:
+        k : Value = keys[i]
+        if value < k:
+            i = left[i]
+        elif k < value:
+            i = right[i]
+        else:
+            return True
+    return False
+
+def dense_delete(D: DenseBST, value: Value) -> DenseBST:
+    arena : DenseArena = D.arena
+    keys, left, right = arena.keys, arena.left, arena.right
+    path : List[Tuple[int, bool]] = []
+    i : int = D.root
+    while i >= 0:
+        k : Value = keys[i]
+        if value < k:
+            path.append((i, True))
+            i = left[i]
+        elif k < value:
+            path.append((i, False))
+            i = right[i]
+        else:
+            break
+    if i < 0:
+        return D
+    start : int = len(keys)
+    # As delete_root: the largest value of the left subtree replaces it
+    if left[i] < 0:
+        replacement : int = right[i]
+    else:
+        spine : List[Tuple[int, bool]] = []
+        left_max : int = left[i]
+        while right[left_max] >= 0:
+            spine.append((left_max, False))
+            left_max = right[left_max]
+        new_left : int = dense_rebuild(arena, spine, left[left_max])
+        keys.append(keys[left_max])
+        left.append(new_left)
+        right.append(right[i])
+        replacement = len(keys) - 1
+    return dense_version(D, dense_rebuild(arena, path, replacement), D.count - 1, start)
+
+# Yield the values of the dense tree 'D' in order, or in reverse order.
+def dense_iter(D: DenseBST, reverse: bool = False) -> Iterator[Value]:
+    keys : array = D.arena.keys
+    first, second = (D.arena.right, D.arena.left) if reverse else (D.arena.left, D.arena.right)
+    stack : List[int] = []
+    i : int = D.root
+    while stack or i >= 0:
+        while i >= 0:
+            stack.append(i)
+            i = first[i]
+        i = stack.pop()
+        yield keys[i]
+        i = second[i]
+
+# Yield, in order, the values 'v' of the dense tree 'D' with
+# lo <= v <= hi, as for range_query.
+def dense_range_query(D: DenseBST, lo: Value, hi: Value) -> Iterator[Value]:
+    keys, left, right = D.arena.keys, D.arena.left, D.arena.right
+    stack : List[int] = []
+    i : int = D.root
+    while i >= 0:
+        if lo <= keys[i]:
+            stack.append(i)
+            i = left[i]
+        else:
+            i = right[i]
+    while stack:
+        i = stack.pop()
+        if hi < keys[i]:
+            return
+        yield keys[i]
+        i = right[i]
+        while i >= 0:
+            stack.append(i)
+            i = left[i]
+
+# Returns a copy of 'D' in a fresh, perfectly balanced arena holding only
+# its own nodes, dropping those left behind by earlier versions.
+def dense_compact(D: DenseBST) -> DenseBST:
+    return dense_build(array(D.typecode, dense_iter(D)))
+
+# Returns the BinarySearchTree holding the values of 'D'.
+def dense_to_bst(D: DenseBST, balance: BalanceMode = "none") -> bst:
+    return from_sorted(default_comparator, dense_iter(D), balance)
@@ -0,0 +1,104 @@
+import asyncio
+from typing import *
+
+from bst import *
+from bst_concurrent import VersionedBST
+
+# A pending write: True for insert, False for delete, the value, and the
+# future resolved with the version that includes it.
+PendingWrite : TypeAlias = Tuple[bool, Value, 'asyncio.Future[int]']
+
+# asyncio front end that coalesces writes to a shared VersionedBST.
+# Inserts and deletes issued by any number of coroutines are buffered for
+# up to 'window' seconds (or until 'max_batch' are waiting), then applied
+# as one merged update with insert_many/delete_many and published as a
+# single new version. Each caller's await returns that version's number.
+# If the merged update raises, the batch is applied again one write at a
+# time: the writes that succeed are published, and only the callers
+# whose own write raised get the exception. Reads go straight to the
+# handle's current snapshot.
+class CoalescingBST:
+    def __init__(self, handle: VersionedBST, window: float = 0.001, max_batch: int = 1024) -> None:
+        self.handle : VersionedBST = handle
+        self.window : float = window
+        self.max_batch : int = max_batch
+        self._pending : List[PendingWrite] = []
+        self._timer : Optional[asyncio.Handle] = None
+
+    def snapshot(self) -> bst:
+        return self.handle.snapshot()
+
+    def lookup(self, value: Value) -> bool:
+        return lookup(self.handle.snapshot(), value)
+
+    async def insert(self, value: Value) -> int:
+        return await self._submit(True, value)
+
+    async def delete(self, value: Value) -> int:
+        return await self._submit(False, value)
+
+    # Apply everything buffered now instead of waiting for the window.
+    async def flush(self) -> None:
+        self._flush()
+
+    def _submit(self, is_insert: bool, value: Value) -> 'asyncio.Future[int]':
+        loop : asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        future : asyncio.Future[int] = loop.create_future()
+        self._pending.append((is_insert, value, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            if self.window > 0:
+                self._timer = loop.call_later(self.window, self._flush)
+            else:
+                self._timer = loop.call_soon(self._flush)
+        return future
+
+    # Apply the buffered writes in submission order, merging each run of
+    # consecutive inserts (or deletes) into one insert_many (delete_many),
+    # and publish the result as one version.
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending : List[PendingWrite] = self._pending
+        self._pending = []
+        if not pending:
+            return
+        
+        def apply(BST: bst) -> bst:
+            start : int = 0
+            while start < len(pending):
+                is_insert : bool = pending[start][0]
+                end : int = start
+                while end < len(pending) and pending[end][0] == is_insert:
+                    end += 1
+                values : List[Value] = [value for _, value, _ in pending[start:end]]
+                BST = insert_many(BST, values) if is_insert else delete_many(BST, values)
+                start = end
+            return BST
+        
+        errors : Dict[int, Exception] = {}
+        
+        # one write at a time, recording (not raising) what each one
+        # raises; update may call this more than once
+        def apply_each(BST: bst) -> bst:
+            errors.clear()
+            for i, (is_insert, value, _) in enumerate(pending):
+                try:
+                    BST = insert(BST, value) if is_insert else delete(BST, value)
+                except Exception as error:
+                    errors[i] = error
+            return BST
+        
+        try:
+            version : int = self.handle.update(apply)
+        except Exception:
+            version = self.handle.update(apply_each)
+        for i, (_, _, future) in enumerate(pending):
+            if future.done():
+                continue
+            if i in errors:
+                future.set_exception(errors[i])
+            else:
+                future.set_result(version)
@@ -0,0 +1,119 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import *
+
+from bst import *
+
+# Eviction policy of a LookupCache:
+#   "lru"   - evict the least recently used value
+#   "clock" - second-chance approximation of LRU: a hit only sets a
+#             reference bit, so hits do no reordering
+CachePolicy : TypeAlias = Literal["lru", "clock"]
+
+# Counters kept by a LookupCache. 'uncacheable' counts lookups of
+# unhashable values, which go straight to the tree.
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    uncacheable: int = 0
+
+# Returns the fraction of cacheable lookups answered from the cache, 0.0
+# if there were none.
+def hit_rate(stats: CacheStats) -> float:
+    total : int = stats.hits + stats.misses
+    if total == 0:
+        return 0.0
+    return stats.hits / total
+
+# Bounded membership cache in front of lookup() on one BST. The BST is
+# immutable, so cached answers - absent values included - never go stale
+# and need no invalidation; after an update, make a new cache for the new
+# BST. Values are cached by hash and ==, which must agree with the BST's
+# order. Not thread-safe: use one cache per thread.
+class LookupCache:
+    def __init__(self, BST: bst, capacity: int = 1024, policy: CachePolicy = "lru") -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1.")
+        if policy not in ("lru", "clock"):
+            raise ValueError(f"unknown cache policy: {policy!r}")
+        self.BST : bst = BST
+        self.capacity : int = capacity
+        self.policy : CachePolicy = policy
+        self.stats : CacheStats = CacheStats()
+        # lru: value -> answer, least recently used first
+        self._lru : OrderedDict[Value, bool] = OrderedDict()
+        # clock: value -> slot, and per slot its value, answer and
+        # reference bit; the hand sweeps the slots for a victim
+        self._slots : Dict[Value, int] = {}
+        self._values : List[Value] = []
+        self._answers : List[bool] = []
+        self._referenced : bytearray = bytearray()
+        self._hand : int = 0
+
+    def __len__(self) -> int:
+        return len(self._lru) if self.policy == "lru" else len(self._slots)
+
+    # Returns True if 'value' is in the BST, False otherwise.
+    def lookup(self, value: Value) -> bool:
+        try:
+            hash(value)
+        except TypeError:
+            self.stats.uncacheable += 1
+            return lookup(self.BST, value)
+        if self.policy == "lru":
+            return self._lookup_lru(value)
+        return self._lookup_clock(value)
+
+    def _lookup_lru(self, value: Value) -> bool:
+        cache : OrderedDict[Value, bool] = self._lru
+        answer : Optional[bool] = cache.get(value)
+        if answer is not None:
+            self.stats.hits += 1
+            cache.move_to_end(value)
+            return answer
+        self.stats.misses += 1
+        answer = lookup(self.BST, value)
+        if len(cache) >= self.capacity:
+            cache.popitem(last=False)
+            self.stats.evictions += 1
+        cache[value] = answer
+        return answer
+
+    def _lookup_clock(self, value: Value) -> bool:
+        slot : Optional[int] = self._slots.get(value)
+        if slot is not None:
+            self.stats.hits += 1
+            self._referenced[slot] = 1
+            return self._answers[slot]
+        self.stats.misses += 1
+        answer : bool = lookup(self.BST, value)
+        if len(self._values) < self.capacity:
+            self._slots[value] = len(self._values)
+            self._values.append(value)
+            self._answers.append(answer)
+            self._referenced.append(0)
+            return answer
+        # sweep, clearing reference bits, to the first unreferenced slot
+        referenced : bytearray = self._referenced
+        hand : int = self._hand
+        while referenced[hand]:
+            referenced[hand] = 0
+            hand = (hand + 1) % self.capacity
+        del self._slots[self._values[hand]]
+        self.stats.evictions += 1
+        self._slots[value] = hand
+        self._values[hand] = value
+        self._answers[hand] = answer
+        self._hand = (hand + 1) % self.capacity
+        return answer
+
+    # Drop every cached answer; the counters are kept.
+    def clear(self) -> None:
+        self._lru.clear()
+        self._slots.clear()
+        self._values.clear()
+        self._answers.clear()
+        self._referenced.clear()
+        self._hand = 0
@@ -0,0 +1,114 @@
+import threading
+from collections import deque
+from typing import *
+
+from bst import *
+
+# Thread-safe handle publishing successive versions of a persistent
+# BinarySearchTree. Readers take the current immutable snapshot without
+# locking; writers compute a new version from the current one and
+# publish it with a compare-and-swap on the version number, retrying if
+# another writer got there first. Each published version is numbered;
+# the most recent 'history' versions, and any pinned ones, can be looked
+# up by number. Dense trees are rejected: versions derived from one
+# share its arena, which concurrent writers would corrupt.
+class VersionedBST:
+    def __init__(self, BST: bst, history: int = 16) -> None:
+        require_nodes(BST, "VersionedBST")
+        # (version, BST) is replaced as a whole, so readers always see a
+        # matching pair without taking the lock
+        self._current : Tuple[int, bst] = (0, BST)
+        self._lock : threading.Lock = threading.Lock()
+        self._history : Deque[Tuple[int, bst]] = deque([(0, BST)], maxlen=max(1, history))
+        self._pinned : Dict[int, Tuple[bst, int]] = {}
+
+    # Returns the current (version, BST) without locking.
+    def current(self) -> Tuple[int, bst]:
+        return self._current
+
+    # Returns the current BST without locking.
+    def snapshot(self) -> bst:
+        return self._current[1]
+
+    @property
+    def version(self) -> int:
+        return self._current[0]
+
+    # Publish 'BST' as the next version if the current version is still
+    # 'expected'. Returns the new version number, or None if another
+    # writer published first.
+    def compare_and_set(self, expected: int, BST: bst) -> Optional[int]:
+        require_nodes(BST, "VersionedBST")
+        with self._lock:
+            version, _ = self._current
+            if version != expected:
+                return None
+            self._current = (version + 1, BST)
+            self._history.append(self._current)
+            return version + 1
+
+    # Replace the current BST with 'change'(current BST), retrying on
+    # conflicting writers. 'change' runs outside the lock and may run
+    # more than once, so it must not have side effects. Returns the new
+    # version number (or the current one if 'change' returned the BST
+    # unchanged).
+    def update(self, change: Callable[[bst], bst]) -> int:
+        while True:
+            version, BST = self._current
+            new_BST : bst = change(BST)
+            if new_BST is BST:
+                return version
+            published : Optional[int] = self.compare_and_set(version, new_BST)
+            if published is not None:
+                return published
+
+    def insert(self, value: Value) -> int:
+        return self.update(lambda BST: insert(BST, value))
+
+    def delete(self, value: Value) -> int:
+        return self.update(lambda BST: delete(BST, value))
+
+    def insert_many(self, values: Iterable[Value]) -> int:
+        batch : List[Value] = list(values)
+        return self.update(lambda BST: insert_many(BST, batch))
+
+    def delete_many(self, values: Iterable[Value]) -> int:
+        batch : List[Value] = list(values)
+        return self.update(lambda BST: delete_many(BST, batch))
+
+    # Keep 'version' (default: the current one) available to get() until
+    # it is unpinned as many times as it was pinned. Raises KeyError if
+    # the version is no longer retained. Returns the pinned version.
+    def pin(self, version: Optional[int] = None) -> int:
+        with self._lock:
+            if version is None:
+                version = self._current[0]
+            BST : bst = self._get_locked(version)
+            _, count = self._pinned.get(version, (BST, 0))
+            self._pinned[version] = (BST, count + 1)
+            return version
+
+    def unpin(self, version: int) -> None:
+        with self._lock:
+            BST, count = self._pinned[version]
+            if count > 1:
+                self._pinned[version] = (BST, count - 1)
+            else:
+                del self._pinned[version]
+
+    # Returns the BST published as 'version' if it is pinned or among the
+    # recent history; raises KeyError otherwise.
+    def get(self, version: int) -> bst:
+        current_version, BST = self._current
+        if version == current_version:
+            return BST
+        with self._lock:
+            return self._get_locked(version)
+
+    def _get_locked(self, version: int) -> bst:
+        if version in self._pinned:
+            return self._pinned[version][0]
+        for retained_version, BST in self._history:
+            if retained_version == version:
+                return BST
+        raise KeyError(f"version {version} is no longer retained.")
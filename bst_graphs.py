@@ -1,116 +1,351 @@
+# Plotting and NumPy are imported inside the functions that use them, so
+# importing this module (e.g. just for the timing harness) stays cheap;
+# annotations are not evaluated, so they may name np types.
+from __future__ import annotations
 import sys
-import unittest
 from typing import *
 from dataclasses import dataclass
 import math
-import matplotlib.pyplot as plt
-import numpy as np
 import random
-sys.setrecursionlimit(10**6)
+import os
+from functools import partial, lru_cache
 
 from bst import *
 
+if TYPE_CHECKING:
+    import numpy as np
+    from bst_cache import CachePolicy
+
 TREES_PER_RUN : int = 10000
 
+# Trials are handed to workers in chunks of this many trees. Each chunk
+# draws from its own generator seeded by (seed, sample, chunk), so the
+# random trees - and hence the results - depend only on the seed, not on
+# how many workers share the chunks.
+TRIALS_PER_CHUNK : int = 250
+
 #  takes in an integer n and generates a BinarySearchTree
 # containing n random floats in [0,1].
-def random_tree(n: int, comes_before: Comparator) -> bst:
+def random_tree(n: int, comes_before: Comparator, rng: Any = random) -> bst:
     """ Returns a random binary search tree with 'n' nodes,
-        using 'comes_before' as the comparator function.
+        using 'comes_before' as the comparator function and 'rng' 
+        (the random module by default) as the source of values.
     """
     tree : bst = BinarySearchTree(comes_before, None)
     for _ in range(n):
-        value : float = random.random() # random float in [0,1)
+        value : float = rng.random() # random float in [0,1)
         tree = insert(tree, value)
     return tree
 
 # Returns the height of the binary search tree 'tree'.
 def calculate_tree_height(tree: BinTree) -> int:
-    """ Returns the height of the binary tree 'tree'. """
-    if tree is None:
-        return 0
-    left_height : int = calculate_tree_height(tree.left)
-    right_height : int = calculate_tree_height(tree.right)
-    return 1 + max(left_height, right_height)
+    """ Returns the height of the binary tree 'tree'. Iterative, so
+        degenerate trees of any height are fine.
+    """
+    height : int = 0
+    stack : List[Tuple[BinTree, int]] = [(tree, 1)]
+    while stack:
+        node, depth = stack.pop()
+        if node is not None:
+            height = max(height, depth)
+            stack.append((node.left, depth + 1))
+            stack.append((node.right, depth + 1))
+    return height
+
+# Window, in seconds, that TREES_PER_RUN repetitions of a calibrated
+# workload should take, and the wall-clock cap on calibration itself.
+TARGET_LOW : float = 1.5
+TARGET_HIGH : float = 2.5
+CALIBRATION_TIME_CAP : float = 10.0
+
+# Workloads to calibrate: 'reps' times, build a random tree of size 'n'
+# and compute its height / just build it by inserting 'n' random values.
+def height_workload(n: int, reps: int) -> None:
+    for _ in range(reps):
+        tree : bst = random_tree(n, default_comparator)
+        _ = calculate_tree_height(tree.tree)
+
+def insert_workload(n: int, reps: int) -> None:
+    for _ in range(reps):
+        random_tree(n, default_comparator)
+
+# Returns the seconds one repetition of 'workload' takes at size 'n', 
+# timing growing batches of repetitions until a batch takes 'min_time'.
+def workload_cost(workload: Callable[[int, int], None], n: int, min_time: float = 0.2) -> float:
+    import time
+    reps : int = 1
+    while True:
+        start : float = time.perf_counter()
+        workload(n, reps)
+        elapsed : float = time.perf_counter() - start
+        if elapsed >= min_time or reps >= TREES_PER_RUN:
+            return elapsed / reps
+        reps = min(TREES_PER_RUN, reps * min(100, max(2, math.ceil(min_time / max(elapsed, 1e-7)))))
+
+# Least-squares fit of cost(n) = a + b * n log2(n + 1) to the measured
+# (n, cost) 'points'. Returns (a, b) with neither negative.
+def fit_cost_model(points: Sequence[Tuple[int, float]]) -> Tuple[float, float]:
+    import statistics
+    xs : List[float] = [n * math.log2(n + 1) for n, _ in points]
+    ys : List[float] = [cost for _, cost in points]
+    mean_x : float = statistics.fmean(xs)
+    mean_y : float = statistics.fmean(ys)
+    spread : float = sum((x - mean_x) ** 2 for x in xs)
+    if spread == 0:
+        return 0.0, max(ys) / max(mean_x, 1.0)
+    b : float = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+    b = max(b, 1e-12)
+    return max(0.0, mean_y - b * mean_x), b
 
-# comes_before func on that relies on standard < behavior
-def default_comparator(x: Value, y: Value) -> bool:
-    return x < y
+# Returns the largest n (at least 1) whose modelled cost a + b * n log2(n+1)
+# is at most 'target'.
+def solve_cost_model(a: float, b: float, target: float) -> int:
+    lo : int = 1
+    hi : int = 2
+    while a + b * hi * math.log2(hi + 1) <= target:
+        hi *= 2
+    while hi - lo > 1:
+        mid : int = (lo + hi) // 2
+        if a + b * mid * math.log2(mid + 1) <= target:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+# Find n_max such that 'trees' repetitions of a workload with per-repetition
+# cost 'cost'(n) (seconds) take between 'low' and 'high' seconds in total.
+# Two small probes fit an n log n cost model; each further probe solves the
+# model for the middle of the window, kept inside the bracket of sizes 
+# known to be too small / too large, and refits with the new point. Only 
+# single repetitions are timed, never the full workload, and calibration 
+# stops after 'time_cap' seconds, returning the largest size known to stay
+# under the window rather than overshooting.
+def calibrate_n_max(cost: Callable[[int], float], trees: int = TREES_PER_RUN,
+                    low: float = TARGET_LOW, high: float = TARGET_HIGH,
+                    time_cap: float = CALIBRATION_TIME_CAP, max_probes: int = 12) -> int:
+    import time
+    start : float = time.perf_counter()
+    target : float = (low + high) / 2 / trees
+    points : List[Tuple[int, float]] = [(n, cost(n)) for n in (8, 64)]
+    too_small : int = 1
+    too_large : Optional[int] = None
+    for n, per_tree in points:
+        if per_tree * trees < low:
+            too_small = max(too_small, n)
+        elif per_tree * trees > high:
+            too_large = n if too_large is None else min(too_large, n)
+    
+    for _ in range(max_probes):
+        if time.perf_counter() - start > time_cap:
+            break
+        if too_large is not None and too_large - too_small <= 1:
+            break
+        a, b = fit_cost_model(points)
+        n = solve_cost_model(a, b, target)
+        if n <= too_small or (too_large is not None and n >= too_large):
+            # the model disagrees with the bracket: bisect it instead
+            n = too_small * 2 if too_large is None else (too_small + too_large) // 2
+        per_tree = cost(n)
+        total : float = per_tree * trees
+        points.append((n, per_tree))
+        print(f"n_max={n}, predicted total_time={total:.4f} seconds")
+        if low <= total <= high:
+            print(f"Chosen n_max: {n}")
+            return n
+        if total < low:
+            too_small = max(too_small, n)
+        else:
+            too_large = n if too_large is None else min(too_large, n)
+    
+    print(f"Calibration stopped early; chosen n_max: {too_small}")
+    return too_small
 
 # Experimentally determine a value of n_max such that performing the 
 # following TREES_PER_RUN times takes about 1.5–2.5 seconds: generate 
 # a random tree of size n_max and compute its height.
 def find_n_max_height() -> int:
-    n_max : int = 1
-    comes_before : Comparator = default_comparator
-    while True:
-        import time
-        start_time : float = time.time()
-        
-        for _ in range(TREES_PER_RUN):
-            tree : bst = random_tree(n_max, comes_before)
-            _ = calculate_tree_height(tree.tree)
-            
-        end_time : float = time.time()
-        total_time : float = end_time - start_time
-        average_time : float = total_time / TREES_PER_RUN
-        
-        print(f"n_max={n_max}, total_time={total_time:.4f} seconds, average_time={average_time:.4f} seconds")
-        if 1.5 <= total_time <= 2.5:  # Check total time, not average
-            break
-        n_max *= 2
-        
-    print(f"Chosen n_max: {n_max}")
-    return n_max
+    return calibrate_n_max(partial(workload_cost, height_workload))
 
 # Experimentally determine a value of n_max such that performing the 
 # following TREES_PER_RUN times takes about 1.5–2.5 seconds: generate 
 # a random tree of size n_max by inserting n_max random values.
 def find_n_max_insert() -> int:
-    n_max : int = 1
-    comes_before : Comparator = default_comparator
-    while True:
-        import time
-        start_time : float = time.time()
-        
-        for _ in range(TREES_PER_RUN):
-            tree : bst = BinarySearchTree(comes_before, None)
-            for _ in range(n_max):
-                value : float = random.random()
-                tree = insert(tree, value)
-                
-        end_time : float = time.time()
-        total_time : float = end_time - start_time
-        average_time : float = total_time / TREES_PER_RUN
-        
-        print(f"n_max={n_max}, total_time={total_time:.4f} seconds, average_time={average_time:.4f} seconds")
-        if 1.5 <= total_time <= 2.5:  # Check total time, not average
-            break
-        n_max *= 2
-        
-    print(f"Chosen n_max for insert: {n_max}")
-    return n_max
+    return calibrate_n_max(partial(workload_cost, insert_workload))
 
-# Make a graph of average tree height (y axis) as a func on of N (x axis). 
-# Use 50 different N samples spaced evenly from N=0 to N=n_max. At each N
-# find the average height of TREES_PER_RUN random trees of size N.
-def create_height_graph(n_max: int) -> None:
-    n_samples : int = 50
-    comes_before : Comparator = default_comparator
+# Returns the random generator for chunk 'chunk' of sample point
+# 'sample' in a run seeded with 'seed'.
+def chunk_rng(seed: int, sample: int, chunk: int) -> random.Random:
+    return random.Random(f"{seed}/{sample}/{chunk}")
+
+# Worker task: total height of 'trees' random trees of size 'n' drawn
+# from chunk_rng(seed, sample, chunk).
+def height_chunk(n: int, trees: int, seed: int, sample: int, chunk: int) -> int:
+    rng : random.Random = chunk_rng(seed, sample, chunk)
+    total_height : int = 0
+    for _ in range(trees):
+        tree : bst = random_tree(n, default_comparator, rng)
+        total_height += calculate_tree_height(tree.tree)
+    return total_height
+
+# Run 'task'(n, trees, seed, sample, chunk) for n = 0, n_max/50, ...,
+# n_max, splitting 'trees' trials per sample point into chunks of
+# TRIALS_PER_CHUNK spread over 'workers' processes (all cores if None;
+# 1 runs everything in this process). Chunk results are summed in the
+# parent in a fixed order and averaged per sample point, so the output
+# for a given seed does not depend on the number of workers.
+def sample_trials(task: Callable[[int, int, int, int, int], float], n_max: int,
+                  trees: int = TREES_PER_RUN, seed: int = 0,
+                  workers: Optional[int] = None,
+                  n_samples: int = 50) -> Tuple[List[float], List[float]]:
+    """ Returns the x coordinates (N) and average task results (y). """
+    jobs : List[Tuple[int, int, int, int, int]] = []
+    for i in range(n_samples + 1):
+        n : int = (i * n_max) // n_samples
+        for chunk, start in enumerate(range(0, trees, TRIALS_PER_CHUNK)):
+            jobs.append((n, min(TRIALS_PER_CHUNK, trees - start), seed, i, chunk))
+    
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        results : List[float] = [task(*job) for job in jobs]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(task, *zip(*jobs), chunksize=max(1, len(jobs) // (4 * workers))))
+    
+    totals : List[float] = [0.0] * (n_samples + 1)
+    for (_, _, _, i, _), result in zip(jobs, results):
+        totals[i] += result
+    x_coords : List[float] = [float((i * n_max) // n_samples) for i in range(n_samples + 1)]
+    y_coords : List[float] = [total / trees for total in totals]
+    return x_coords, y_coords
+
+# Simulate inserting the keys 0..n-1 into an empty BST in 'trials' 
+# independent random orders, all trials at once with NumPy and without 
+# building any Node objects. Returns an int32 array of shape (trials, n)
+# whose [t, i] entry is the depth (root = 1) of the i-th key inserted in
+# trial t.
+#
+# A new key's parent is whichever of its in-order neighbours among the 
+# keys inserted before it was inserted last. Removing the keys in 
+# reverse insertion order from a doubly linked list over the sorted keys
+# exposes exactly those neighbours, one vectorised step per key; a 
+# second pass in insertion order then adds one to the parent's depth.
+def simulate_depths(n: int, trials: int, rng: np.random.Generator) -> np.ndarray:
+    import numpy as np
+    depth : np.ndarray = np.empty((trials, n), dtype=np.int32)
+    if n == 0:
+        return depth
+    rows : np.ndarray = np.arange(trials)
+    # order[t, i] is the key inserted at step i; step_of is its inverse
+    order : np.ndarray = np.argsort(rng.random((trials, n)), axis=1).astype(np.int32)
+    step_of : np.ndarray = np.empty((trials, n), dtype=np.int32)
+    step_of[rows[:, None], order] = np.arange(n, dtype=np.int32)
+    
+    # linked list over slots 0..n+1: slot k+1 holds key k, 0 and n+1 are
+    # sentinels; a neighbour's step is -1 if it is a sentinel
+    prev_slot : np.ndarray = np.tile(np.arange(-1, n + 1, dtype=np.int32), (trials, 1))
+    next_slot : np.ndarray = np.tile(np.arange(1, n + 3, dtype=np.int32), (trials, 1))
+    padded_step : np.ndarray = np.full((trials, n + 2), -1, dtype=np.int32)
+    padded_step[:, 1:n + 1] = step_of
+    parent_step : np.ndarray = np.empty((trials, n), dtype=np.int32)
+    for i in range(n - 1, -1, -1):
+        slot : np.ndarray = order[:, i] + 1
+        before : np.ndarray = prev_slot[rows, slot]
+        after : np.ndarray = next_slot[rows, slot]
+        next_slot[rows, before] = after
+        prev_slot[rows, after] = before
+        parent_step[:, i] = np.maximum(padded_step[rows, before], padded_step[rows, after])
+    
+    for i in range(n):
+        parent : np.ndarray = parent_step[:, i]
+        depth[:, i] = np.where(parent >= 0, depth[rows, np.maximum(parent, 0)] + 1, 1)
+    return depth
+
+# Subtrees of at most this many keys get their height drawn from an
+# exact table (small_tree_heights) instead of being split further.
+SMALL_TREE : int = 256
+
+# Returns the height distribution of random BSTs of every size up to 'k',
+# laid out for one searchsorted: entry s * (k + 1) + h is s plus the
+# probability that a random BST of size s has height at most h. The root
+# of a random BST is uniform among its keys and its subtrees are
+# independent random BSTs, which gives the recurrence.
+@lru_cache(maxsize=None)
+def small_tree_heights(k: int) -> np.ndarray:
+    import numpy as np
+    cdf : np.ndarray = np.zeros((k + 1, k + 1))
+    cdf[0, :] = 1.0
+    for size in range(1, k + 1):
+        cdf[size, 1:] = (cdf[:size, :-1] * cdf[size - 1::-1, :-1]).mean(axis=0)
+    return (cdf + np.arange(k + 1)[:, None]).ravel()
+
+# Returns the heights (as calculate_tree_height counts them) of 'trials'
+# random BSTs of size 'n', in batches of at most 'max_cells' trial-keys
+# to bound memory. Only subtree sizes are simulated, a whole tree level
+# of every trial per vectorised step: each subtree splits around a
+# uniform root into two independent ones, and subtrees of at most
+# SMALL_TREE keys draw their height from small_tree_heights. So the
+# Python loop runs about 4.3 ln n times rather than 2n as it would with
+# simulate_depths, and the work per trial is about 2n / SMALL_TREE.
+def simulate_heights(n: int, trials: int, seed: int = 0, max_cells: int = 1 << 24) -> np.ndarray:
+    import numpy as np
+    rng : np.random.Generator = np.random.default_rng(seed)
+    if n == 0:
+        return np.zeros(trials, dtype=np.int32)
+    table : np.ndarray = small_tree_heights(SMALL_TREE)
+    batch : int = max(1, max_cells // n)
+    heights : List[np.ndarray] = []
+    for start in range(0, trials, batch):
+        height : np.ndarray = np.zeros(min(batch, trials - start), dtype=np.int32)
+        # the non-empty subtrees rooted at 'depth', and their trials
+        trial : np.ndarray = np.arange(len(height))
+        size : np.ndarray = np.full(len(height), n, dtype=np.int64)
+        depth : int = 0
+        while len(size):
+            depth += 1
+            small : np.ndarray = size <= SMALL_TREE
+            if small.any():
+                sizes : np.ndarray = size[small]
+                drawn : np.ndarray = np.searchsorted(table, sizes + rng.random(len(sizes))) - sizes * (SMALL_TREE + 1)
+                np.maximum.at(height, trial[small], depth - 1 + np.minimum(drawn, sizes))
+                size, trial = size[~small], trial[~small]
+            height[trial] = np.maximum(height[trial], depth)
+            left : np.ndarray = rng.integers(0, size)
+            size = np.concatenate((left, size - 1 - left))
+            trial = np.concatenate((trial, trial))
+            size, trial = size[size > 0], trial[size > 0]
+        heights.append(height)
+    return np.concatenate(heights)
+
+# NumPy counterpart of sample_trials(height_chunk, ...): average height
+# of 'trees' simulated random BSTs at each of the 51 sample points.
+def simulate_height_samples(n_max: int, trees: int = TREES_PER_RUN, seed: int = 0,
+                            n_samples: int = 50) -> Tuple[List[float], List[float]]:
     x_coords : List[float] = []
     y_coords : List[float] = []
-    
     for i in range(n_samples + 1):
         n : int = (i * n_max) // n_samples
-        total_height : int = 0
-        for _ in range(TREES_PER_RUN):
-            tree : bst = random_tree(n, comes_before)
-            height : int = calculate_tree_height(tree.tree)
-            total_height += height
-        average_height : float = total_height / TREES_PER_RUN
         x_coords.append(float(n))
-        y_coords.append(average_height)
+        y_coords.append(float(simulate_heights(n, trees, seed + i).mean()))
+    return x_coords, y_coords
+
+# Make a graph of average tree height (y axis) as a func on of N (x axis). 
+# Use 50 different N samples spaced evenly from N=0 to N=n_max. At each N
+# find the average height of TREES_PER_RUN random trees of size N, either
+# by building the trees ("trees") or with the NumPy simulation ("numpy"),
+# which can handle a far larger n_max.
+def create_height_graph(n_max: int, workers: Optional[int] = None, seed: int = 0,
+                        engine: str = "trees") -> None:
+    if engine == "numpy":
+        x_coords, y_coords = simulate_height_samples(n_max, TREES_PER_RUN, seed)
+    elif engine == "trees":
+        x_coords, y_coords = sample_trials(height_chunk, n_max, TREES_PER_RUN, seed, workers)
+    else:
+        raise ValueError(f"unknown engine: {engine!r}")
     
+    import matplotlib.pyplot as plt
+    import numpy as np
     x_numpy : np.ndarray = np.array(x_coords)
     y_numpy : np.ndarray = np.array(y_coords)
     plt.plot(x_numpy, y_numpy, label='Average Tree Height')
@@ -121,44 +356,680 @@ def create_height_graph(n_max: int) -> None:
     plt.legend() # makes the 'label's show up
     plt.show()
     
-def create_insert_graph(n_max: int) -> None:
-    n_samples : int = 50
-    comes_before : Comparator = default_comparator
+# Summary of a timing run: per-call times in nanoseconds, with a 95%
+# confidence interval for the median.
+@dataclass(frozen=True)
+class TimingStats:
+    median_ns: float
+    p95_ns: float
+    mean_ns: float
+    ci_low_ns: float
+    ci_high_ns: float
+    samples: int
+
+# Default batching for measure(): each sample times TIMING_BATCH calls, 
+# after TIMING_WARMUP discarded batches, TIMING_SAMPLES times over.
+TIMING_BATCH : int = 100
+TIMING_SAMPLES : int = 200
+TIMING_WARMUP : int = 10
+
+# Summarise per-call times 'samples' (ns). The confidence interval for
+# the median is distribution-free: the order statistics at
+# n/2 -/+ 1.96 * sqrt(n)/2.
+def timing_stats(samples: Sequence[float]) -> TimingStats:
+    import statistics
+    ordered : List[float] = sorted(samples)
+    count : int = len(ordered)
+    half_width : float = 1.96 * math.sqrt(count) / 2
+    low : int = max(0, math.floor(count / 2 - half_width))
+    high : int = min(count - 1, math.ceil(count / 2 + half_width))
+    return TimingStats(
+        median_ns=statistics.median(ordered),
+        p95_ns=ordered[min(count - 1, math.ceil(0.95 * count) - 1)],
+        mean_ns=statistics.fmean(ordered),
+        ci_low_ns=ordered[low],
+        ci_high_ns=ordered[high],
+        samples=count,
+    )
+
+# Time 'op'(x) for the values x of 'inputs', which are cycled through in
+# order. Each sample is the per-call time of a batch of 'batch' calls
+# measured with perf_counter_ns, so timer resolution and overhead are
+# spread over the batch; 'warmup' batches run first and are discarded.
+def measure(op: Callable[[Any], Any], inputs: Sequence[Any],
+            batch: int = TIMING_BATCH, samples: int = TIMING_SAMPLES,
+            warmup: int = TIMING_WARMUP) -> TimingStats:
+    import time
+    per_call : List[float] = []
+    position : int = 0
+    for i in range(warmup + samples):
+        args : Sequence[Any] = [inputs[(position + j) % len(inputs)] for j in range(batch)]
+        position += batch
+        start : int = time.perf_counter_ns()
+        for x in args:
+            op(x)
+        elapsed : int = time.perf_counter_ns() - start
+        if i >= warmup:
+            per_call.append(elapsed / batch)
+    return timing_stats(per_call)
+
+# Time single inserts into one prebuilt random tree per size N = 0,
+# n_max/50, ..., n_max. Trees are never modified, so the same tree is
+# reused for every timed call; each call inserts a fresh random value.
+def insert_timings(n_max: int, seed: int = 0, n_samples: int = 50) -> Tuple[List[float], List[TimingStats]]:
+    """ Returns the x coordinates (N) and the timing of each point. """
+    rng : random.Random = random.Random(seed)
     x_coords : List[float] = []
-    y_coords : List[float] = []
-    
+    timings : List[TimingStats] = []
     for i in range(n_samples + 1):
         n : int = (i * n_max) // n_samples
-        total_time : float = 0.0
-        
-        for _ in range(TREES_PER_RUN):
-            # First, create a tree of size n
-            tree : bst = random_tree(n, comes_before)
-            
-            # Then time inserting ONE additional random value
-            import time
-            start_time : float = time.time()
-            value : float = random.random()
-            tree = insert(tree, value)
-            end_time : float = time.time()
-            
-            total_time += (end_time - start_time)
-            
-        average_time : float = total_time / TREES_PER_RUN
-        
+        tree : bst = random_tree(n, default_comparator, rng)
+        values : List[float] = [rng.random() for _ in range(TIMING_BATCH * 10)]
         x_coords.append(float(n))
-        y_coords.append(average_time)
+        timings.append(measure(partial(insert, tree), values))
+    return x_coords, timings
+
+# Graph the median time of a single insert against tree size, with its
+# 95% confidence interval shaded and the 95th percentile dashed.
+def create_insert_graph(n_max: int, seed: int = 0) -> None:
+    x_coords, timings = insert_timings(n_max, seed)
     
+    import matplotlib.pyplot as plt
+    import numpy as np
     x_numpy : np.ndarray = np.array(x_coords)
-    y_numpy : np.ndarray = np.array(y_coords)
-    plt.plot(x_numpy, y_numpy, label='Average Single Insert Time')
+    median_numpy : np.ndarray = np.array([t.median_ns / 1e9 for t in timings])
+    plt.plot(x_numpy, median_numpy, label='Median Single Insert Time')
+    plt.fill_between(x_numpy, [t.ci_low_ns / 1e9 for t in timings],
+                     [t.ci_high_ns / 1e9 for t in timings], alpha=0.3, label='95% CI of median')
+    plt.plot(x_numpy, [t.p95_ns / 1e9 for t in timings], linestyle='--', label='95th percentile')
     plt.xlabel("Tree Size (N)")
-    plt.ylabel("Average Time to Insert One Value (seconds)")
+    plt.ylabel("Time to Insert One Value (seconds)")
     plt.title("Time to Insert Single Value into BST vs Tree Size")
     plt.grid(True)
     plt.legend()
     plt.show()
 
+# Insertion orders that degrade a plain BST, each a permutation of 
+# range(n): sorted, reversed, alternating between the two ends, and 
+# sorted with a handful of random swaps drawn from 'rng'.
+def adversarial_orders(n: int, rng: Any = random) -> Dict[str, List[int]]:
+    zigzag : List[int] = []
+    lo, hi = 0, n - 1
+    while lo <= hi:
+        zigzag.append(lo)
+        if lo != hi:
+            zigzag.append(hi)
+        lo, hi = lo + 1, hi - 1
+    nearly_sorted : List[int] = list(range(n))
+    for _ in range(max(1, n // 100)):
+        i : int = rng.randrange(n)
+        j : int = rng.randrange(n)
+        nearly_sorted[i], nearly_sorted[j] = nearly_sorted[j], nearly_sorted[i]
+    shuffled : List[int] = list(range(n))
+    rng.shuffle(shuffled)
+    return {
+        "sorted": list(range(n)),
+        "reversed": list(range(n - 1, -1, -1)),
+        "zigzag": zigzag,
+        "nearly sorted": nearly_sorted,
+        "random": shuffled,
+    }
+
+# Compare the height of a plain BST and a weight-balanced BST built
+# from the same insertion order, for each of the adversarial orders.
+def compare_balanced_heights(n: int) -> Dict[str, Tuple[int, int]]:
+    """ Returns {order name: (plain height, balanced height)} for trees
+        of 'n' nodes, and prints the table.
+    """
+    results : Dict[str, Tuple[int, int]] = {}
+    print(f"{'order':>14} {'plain':>8} {'balanced':>9}   (n={n}, log2(n+1)={math.log2(n + 1):.1f})")
+    for name, order in adversarial_orders(n).items():
+        plain : bst = BinarySearchTree(default_comparator, None)
+        balanced : bst = BinarySearchTree(default_comparator, None, "weight")
+        for value in order:
+            plain = insert(plain, value)
+            balanced = insert(balanced, value)
+        plain_height : int = calculate_tree_height(plain.tree)
+        balanced_height : int = calculate_tree_height(balanced.tree)
+        results[name] = (plain_height, balanced_height)
+        print(f"{name:>14} {plain_height:>8} {balanced_height:>9}")
+    return results
+
+# For each size N = n_max/n_samples, ..., n_max, build a plain and a
+# randomized BST by inserting range(N) in sorted, reversed and random
+# order, recording the height of each and the mean time of one insert.
+# 'rng' drives both the random order and the randomized BST; if None, a
+# random.Random(seed) is used, so the global generator is left alone.
+def randomized_vs_plain(n_max: int, n_samples: int = 10, seed: int = 0,
+                        rng: Optional[random.Random] = None
+                        ) -> Tuple[List[int], Dict[Tuple[str, BalanceMode], Tuple[List[int], List[float]]]]:
+    """ Returns the sizes N and, per (order, balance mode), the heights
+        and the mean insert times in seconds at each N.
+    """
+    import time
+    if rng is None:
+        rng = random.Random(seed)
+    sizes : List[int] = [(i * n_max) // n_samples for i in range(1, n_samples + 1)]
+    results : Dict[Tuple[str, BalanceMode], Tuple[List[int], List[float]]] = {}
+    for n in sizes:
+        orders : Dict[str, List[int]] = adversarial_orders(n, rng)
+        for name in ("sorted", "reversed", "random"):
+            for balance in ("none", "randomized"):
+                tree : bst = BinarySearchTree(default_comparator, None, balance, rng=rng)
+                start : int = time.perf_counter_ns()
+                for value in orders[name]:
+                    tree = insert(tree, value)
+                elapsed : int = time.perf_counter_ns() - start
+                heights, times = results.setdefault((name, balance), ([], []))
+                heights.append(calculate_tree_height(tree.tree))
+                times.append(elapsed / n / 1e9)
+    return sizes, results
+
+# Graph the height and the per-insert time of plain and randomized BSTs
+# against N for sorted, reversed and random insertion orders.
+def create_randomized_graph(n_max: int = 2000, n_samples: int = 10, seed: int = 0) -> None:
+    import matplotlib.pyplot as plt
+    sizes, results = randomized_vs_plain(n_max, n_samples, seed)
+    figure, (height_axes, time_axes) = plt.subplots(1, 2, figsize=(12, 5))
+    for (name, balance), (heights, times) in results.items():
+        style : str = '-' if balance == "randomized" else '--'
+        label : str = f"{balance} BST, {name}"
+        height_axes.plot(sizes, heights, linestyle=style, label=label)
+        time_axes.plot(sizes, times, linestyle=style, label=label)
+    height_axes.set_xlabel("Tree Size (N)")
+    height_axes.set_ylabel("Height")
+    height_axes.set_title("Height of Plain vs Randomized BST")
+    time_axes.set_xlabel("Tree Size (N)")
+    time_axes.set_ylabel("Mean Time per Insert (seconds)")
+    time_axes.set_yscale("log")
+    time_axes.set_title("Insert Time of Plain vs Randomized BST")
+    for axes in (height_axes, time_axes):
+        axes.grid(True)
+        axes.legend()
+    figure.tight_layout()
+    plt.show()
+
+# Reference copies of the original recursive insert/lookup/delete, kept
+# only so benchmark_engines can measure the iterative engine against them.
+def recursive_insert(BST: bst, value: Value) -> bst:
+    comes_before : Comparator = BST.comes_before
+    def insert_helper(tree: BinTree) -> BinTree:
+        if tree is None:
+            return Node(value, None, None)
+        if comes_before(value, tree.value):
+            return Node(tree.value, insert_helper(tree.left), tree.right)
+        elif comes_before(tree.value, value):
+            return Node(tree.value, tree.left, insert_helper(tree.right))
+        return tree
+    return BinarySearchTree(comes_before, insert_helper(BST.tree))
+
+def recursive_lookup(BST: bst, value: Value) -> bool:
+    comes_before : Comparator = BST.comes_before
+    def lookup_helper(tree: BinTree) -> bool:
+        if tree is None:
+            return False
+        if comes_before(value, tree.value):
+            return lookup_helper(tree.left)
+        elif comes_before(tree.value, value):
+            return lookup_helper(tree.right)
+        return True
+    return lookup_helper(BST.tree)
+
+def recursive_delete(BST: bst, value: Value) -> bst:
+    if not recursive_lookup(BST, value):
+        return BST
+    comes_before : Comparator = BST.comes_before
+    def largest(tree: Node) -> Value:
+        return tree.value if tree.right is None else largest(tree.right)
+    def delete_largest(tree: Node) -> BinTree:
+        if tree.right is None:
+            return tree.left
+        return Node(tree.value, tree.left, delete_largest(tree.right))
+    def delete_helper(tree: BinTree) -> BinTree:
+        if tree is None:
+            return None
+        if comes_before(value, tree.value):
+            return Node(tree.value, delete_helper(tree.left), tree.right)
+        elif comes_before(tree.value, value):
+            return Node(tree.value, tree.left, delete_helper(tree.right))
+        if tree.left is None:
+            return tree.right
+        return Node(largest(tree.left), delete_largest(tree.left), tree.right)
+    return BinarySearchTree(comes_before, delete_helper(BST.tree))
+
+# Time 'ops' random inserts, lookups and deletes against one random tree
+# of each size in 'sizes', for both the recursive reference functions and
+# the iterative engine in bst.py, and print the per-operation cost.
+def benchmark_engines(sizes: Sequence[int] = (10**3, 10**4, 10**5, 10**6),
+                      ops: int = 2000) -> Dict[int, Dict[str, Tuple[float, float]]]:
+    """ Returns {n: {operation: (recursive us/op, iterative us/op)}}. """
+    import time
+    engines : Dict[str, Tuple[Callable[..., Any], Callable[..., Any]]] = {
+        "insert": (recursive_insert, insert),
+        "lookup": (recursive_lookup, lookup),
+        "delete": (recursive_delete, delete),
+    }
+    results : Dict[int, Dict[str, Tuple[float, float]]] = {}
+    print(f"{'n':>9} {'op':>7} {'recursive us':>13} {'iterative us':>13} {'speedup':>8}")
+    for n in sizes:
+        tree : bst = random_tree(n, default_comparator)
+        inserted : List[float] = [random.random() for _ in range(ops)]
+        present : List[float] = []
+        for _ in range(ops):
+            # pick existing values by walking a random root-to-leaf path
+            node : BinTree = tree.tree
+            while node is not None:
+                present.append(node.value)
+                node = node.left if random.random() < 0.5 else node.right
+        present = random.sample(present, min(ops, len(present)))
+        results[n] = {}
+        for name, (recursive_op, iterative_op) in engines.items():
+            values : List[float] = inserted if name == "insert" else present
+            timings : List[float] = []
+            for op in (recursive_op, iterative_op):
+                start : float = time.perf_counter()
+                for value in values:
+                    op(tree, value)
+                timings.append((time.perf_counter() - start) / len(values) * 1e6)
+            results[n][name] = (timings[0], timings[1])
+            print(f"{n:>9} {name:>7} {timings[0]:>13.2f} {timings[1]:>13.2f} {timings[0] / timings[1]:>7.2f}x")
+    return results
+
+# For each power of two up to 'n_max', the range of tree sizes that
+# find_n_max_insert calibrates over, time building a tree from random
+# values with repeated insert versus a single from_iterable call, and
+# print the results.
+def benchmark_bulk_build(n_max: int = 2**16, repeats: int = 3) -> Dict[int, Tuple[float, float]]:
+    """ Returns {n: (seconds via insert, seconds via from_iterable)},
+        each the best of 'repeats' runs.
+    """
+    import time
+    results : Dict[int, Tuple[float, float]] = {}
+    print(f"{'n':>8} {'insert s':>10} {'from_iterable s':>16} {'speedup':>8}")
+    n : int = 1
+    while n <= n_max:
+        values : List[float] = [random.random() for _ in range(n)]
+        insert_time : float = math.inf
+        bulk_time : float = math.inf
+        for _ in range(repeats):
+            start : float = time.perf_counter()
+            tree : bst = BinarySearchTree(default_comparator, None)
+            for value in values:
+                tree = insert(tree, value)
+            insert_time = min(insert_time, time.perf_counter() - start)
+            
+            start = time.perf_counter()
+            tree = from_iterable(default_comparator, values)
+            bulk_time = min(bulk_time, time.perf_counter() - start)
+        results[n] = (insert_time, bulk_time)
+        print(f"{n:>8} {insert_time:>10.5f} {bulk_time:>16.5f} {insert_time / bulk_time:>7.1f}x")
+        n *= 2
+    return results
+
+# Returns the number of nodes of 'new' that are not shared with 'old',
+# i.e. the nodes allocated to turn one version into the other.
+def count_new_nodes(old: BinTree, new: BinTree) -> int:
+    old_ids : Set[int] = set()
+    stack : List[BinTree] = [old]
+    while stack:
+        node : BinTree = stack.pop()
+        if node is not None:
+            old_ids.add(id(node))
+            stack.extend((node.left, node.right))
+    count : int = 0
+    stack = [new]
+    while stack:
+        node = stack.pop()
+        if node is not None and id(node) not in old_ids:
+            count += 1
+            stack.extend((node.left, node.right))
+    return count
+
+# Apply a batch of k random inserts, then delete the same values again,
+# on a random tree of 'n' values: once value-by-value and once with
+# insert_many/delete_many. Prints the time of each phase and the number
+# of nodes the inserts copied (every version's path for the one-at-a-time
+# run, of which all but the last are garbage straight away).
+def benchmark_batch_updates(n: int = 10**5, batch_sizes: Sequence[int] = (10**3, 10**4, 10**5),
+                            balance: BalanceMode = "none") -> Dict[int, Dict[str, Tuple[float, float, int]]]:
+    """ Returns {batch size: {method: (insert s, delete s, nodes copied)}}. """
+    import time
+    base : bst = from_iterable(default_comparator, [random.random() for _ in range(n)], balance)
+    results : Dict[int, Dict[str, Tuple[float, float, int]]] = {}
+    print(f"{'batch':>8} {'method':>12} {'insert s':>9} {'delete s':>9} {'copied':>9}")
+    for k in batch_sizes:
+        batch : List[float] = [random.random() for _ in range(k)]
+        results[k] = {}
+        
+        start : float = time.perf_counter()
+        tree : bst = base
+        for value in batch:
+            tree = insert(tree, value)
+        insert_time : float = time.perf_counter() - start
+        start = time.perf_counter()
+        for value in batch:
+            tree = delete(tree, value)
+        delete_time : float = time.perf_counter() - start
+        copied : int = 0
+        tree = base
+        for value in batch:
+            copied += len(find_path(tree, value)[0]) + 1
+            tree = insert(tree, value)
+        results[k]["insert"] = (insert_time, delete_time, copied)
+        
+        start = time.perf_counter()
+        tree = insert_many(base, batch)
+        insert_time = time.perf_counter() - start
+        start = time.perf_counter()
+        delete_many(tree, batch)
+        delete_time = time.perf_counter() - start
+        results[k]["insert_many"] = (insert_time, delete_time, count_new_nodes(base.tree, tree.tree))
+        
+        for name, (insert_time, delete_time, copied) in results[k].items():
+            print(f"{k:>8} {name:>12} {insert_time:>9.4f} {delete_time:>9.4f} {copied:>9}")
+    return results
+
+# Reference copy of the former frozen-dataclass node, kept only so
+# benchmark_node_memory can compare it with the tuple-backed Node.
+@dataclass(frozen=True)
+class DataclassNode:
+    value: Value
+    left: Optional['DataclassNode']
+    right: Optional['DataclassNode']
+    key: Any = None
+    size: int = 1
+
+# Build 'n' nodes of the tuple-backed Node and of the former dataclass
+# node, and print the construction time and bytes per node of each.
+def benchmark_node_memory(n: int = 10**6) -> Dict[str, Tuple[float, float]]:
+    """ Returns {node type: (ns per construction, bytes per node)}. """
+    import time
+    results : Dict[str, Tuple[float, float]] = {}
+    
+    tree : bst = from_sorted(default_comparator, range(n))
+    tuple_leaf : Node = Node(0, None, None)
+    start : float = time.perf_counter()
+    tuple_nodes : List[Node] = [Node(i, tuple_leaf, tuple_leaf) for i in range(n)]
+    elapsed : float = time.perf_counter() - start
+    results["Node"] = (elapsed / n * 1e9, memory_footprint(tree).bytes_per_node)
+    
+    leaf : DataclassNode = DataclassNode(0, None, None)
+    start = time.perf_counter()
+    nodes : List[DataclassNode] = [DataclassNode(i, leaf, leaf) for i in range(n)]
+    elapsed = time.perf_counter() - start
+    per_node : float = sys.getsizeof(leaf) + (sys.getsizeof(leaf.__dict__) if hasattr(leaf, '__dict__') else 0)
+    results["DataclassNode"] = (elapsed / n * 1e9, float(per_node))
+    
+    print(f"{'node type':>14} {'ns/node':>9} {'bytes/node':>11}   (n={n})")
+    for name, (ns, size) in results.items():
+        print(f"{name:>14} {ns:>9.0f} {size:>11.0f}")
+    return results
+
+# Compare the node engine with the dense engine on 'n' random floats
+# ordered by default_comparator: median time of one insert, lookup and
+# delete, measured with the timing harness on the same values, the time
+# per value of looking up a batch of them (one lookup call each for the
+# node engine, one bst_index.dense_lookup_many call for the dense one),
+# and bytes per value, counting the boxed float a Node holds: as built,
+# and again after 'n' updates (alternately inserting a new value and
+# deleting an old one), which leave copied nodes behind in the arena
+# until it is compacted.
+def benchmark_dense_engine(n: int = 10**5, seed: int = 0) -> Dict[str, Dict[str, float]]:
+    """ Returns {engine: {'insert'/'lookup'/'delete'/'batch': median ns,
+        'bytes'/'updated bytes': bytes per value}} and prints the table
+        with gains.
+    """
+    import numpy as np
+    from bst_index import dense_lookup_many
+    rng : random.Random = random.Random(seed)
+    values : List[float] = [rng.random() for _ in range(n)]
+    fresh : List[float] = [rng.random() for _ in range(TIMING_BATCH * 10)]
+    present : List[float] = rng.sample(values, TIMING_BATCH * 10)
+    node_tree : bst = from_iterable(default_comparator, values)
+    dense_tree : DenseBST = from_iterable(default_comparator, values, typecode='d')
+    engines : Dict[str, Any] = {"node": node_tree, "dense": dense_tree}
+    
+    
+    def node_bytes(tree: bst) -> float:
+        return memory_footprint(tree).bytes_per_node + sys.getsizeof(0.5)
+    
+    def dense_bytes(tree: DenseBST) -> float:
+        arena : DenseArena = tree.arena
+        return sum(column.itemsize * len(column) for column in (arena.keys, arena.left, arena.right)) / len(tree)
+    
+    byte_counts : Dict[str, Callable[[Any], float]] = {"node": node_bytes, "dense": dense_bytes}
+    results : Dict[str, Dict[str, float]] = {}
+    for name, tree in engines.items():
+        results[name] = {
+            "bytes": byte_counts[name](tree),
+            "insert": measure(partial(insert, tree), fresh).median_ns,
+            "lookup": measure(partial(lookup, tree), present).median_ns,
+            "delete": measure(partial(delete, tree), present).median_ns,
+        }
+    batch : np.ndarray = np.array(present)
+    node_batch : Callable[[np.ndarray], Any] = lambda queries: [lookup(engines["node"], v) for v in queries.tolist()]
+    dense_batch : Callable[[np.ndarray], Any] = partial(dense_lookup_many, engines["dense"])
+    for name, lookup_batch in (("node", node_batch), ("dense", dense_batch)):
+        results[name]["batch"] = measure(lookup_batch, [batch], batch=1, samples=20, warmup=2).median_ns / len(batch)
+    
+    updates : List[Tuple[bool, float]] = []
+    for old, new in zip(rng.sample(values, n // 2), (rng.random() for _ in range(n // 2))):
+        updates += [(True, new), (False, old)]
+    for adding, value in updates:
+        node_tree = insert(node_tree, value) if adding else delete(node_tree, value)
+        dense_tree = insert(dense_tree, value) if adding else delete(dense_tree, value)
+    results["node"]["updated bytes"] = node_bytes(node_tree)
+    results["dense"]["updated bytes"] = dense_bytes(dense_tree)
+    
+    print(f"{'engine':>8} {'insert ns':>10} {'lookup ns':>10} {'delete ns':>10} {'batch ns':>9} {'bytes':>6} {'updated':>8}   (n={n})")
+    for name, row in results.items():
+        print(f"{name:>8} {row['insert']:>10.0f} {row['lookup']:>10.0f} {row['delete']:>10.0f} {row['batch']:>9.0f} {row['bytes']:>6.0f} {row['updated bytes']:>8.0f}")
+    gains : Dict[str, float] = {column: results["node"][column] / results["dense"][column] for column in results["node"]}
+    print(f"{'gain':>8} {gains['insert']:>9.1f}x {gains['lookup']:>9.1f}x {gains['delete']:>9.1f}x {gains['batch']:>8.1f}x {gains['bytes']:>5.1f}x {gains['updated bytes']:>7.1f}x")
+    return results
+
+# Reference copy of the former delete, which looked the value up first,
+# descended again to delete it and walked the left spine twice to remove
+# the predecessor. Kept only for benchmark_delete_mix.
+def multi_pass_delete(BST: bst, value: Value) -> bst:
+    if not lookup(BST, value):
+        return BST
+    path, tree = find_path(BST, value)
+    assert tree is not None
+    make : NodeBuilder = node_builder(BST.balance)
+    if tree.left is None:
+        replacement : BinTree = tree.right
+    else:
+        left_max : Node = largest_node(tree.left)
+        replacement = make(left_max.value, delete_largest_value(tree.left, make), tree.right, left_max.key)
+    return with_tree(BST, rebuild_path(path, replacement, make))
+
+# Run workloads mixing deletes (of which 'absent_share' target values not
+# in the tree) with inserts against a random tree of 'n' values, using
+# the single-pass delete and the former multi-pass one, and print the
+# time per operation of each.
+def benchmark_delete_mix(n: int = 10**5, ops: int = 20000,
+                         delete_shares: Sequence[float] = (0.5, 0.9, 1.0),
+                         absent_share: float = 0.25) -> Dict[float, Tuple[float, float]]:
+    """ Returns {delete share: (multi-pass us/op, single-pass us/op)}. """
+    import time
+    values : List[float] = [random.random() for _ in range(n)]
+    base : bst = from_iterable(default_comparator, values)
+    results : Dict[float, Tuple[float, float]] = {}
+    print(f"{'deletes':>8} {'multi-pass us':>14} {'single-pass us':>15} {'speedup':>8}")
+    for share in delete_shares:
+        workload : List[Tuple[bool, float]] = []
+        for _ in range(ops):
+            if random.random() < share:
+                target : float = random.random() if random.random() < absent_share else random.choice(values)
+                workload.append((True, target))
+            else:
+                workload.append((False, random.random()))
+        timings : List[float] = []
+        for delete_op in (multi_pass_delete, delete):
+            tree : bst = base
+            start : float = time.perf_counter()
+            for is_delete, value in workload:
+                tree = delete_op(tree, value) if is_delete else insert(tree, value)
+            timings.append((time.perf_counter() - start) / ops * 1e6)
+        results[share] = (timings[0], timings[1])
+        print(f"{share:>8.0%} {timings[0]:>14.2f} {timings[1]:>15.2f} {timings[0] / timings[1]:>7.2f}x")
+    return results
+
+# Run 'threads' threads, each performing 'ops' operations on a shared 
+# VersionedBST of 'n' random values: lookups on the current snapshot with
+# probability 'read_ratio', otherwise an insert or delete through the 
+# handle. Prints the total throughput for each ratio.
+def benchmark_versioned(n: int = 10**4, threads: int = 4, ops: int = 20000,
+                        read_ratios: Sequence[float] = (0.5, 0.9, 0.99)) -> Dict[float, float]:
+    """ Returns {read ratio: operations per second}. """
+    import threading
+    import time
+    from bst_concurrent import VersionedBST
+    
+    results : Dict[float, float] = {}
+    print(f"{'reads':>6} {'threads':>8} {'ops/s':>10}")
+    for ratio in read_ratios:
+        handle : VersionedBST = VersionedBST(from_iterable(default_comparator, [random.random() for _ in range(n)]))
+        
+        def worker(seed: int) -> None:
+            rng : random.Random = random.Random(seed)
+            for _ in range(ops):
+                value : float = rng.random()
+                if rng.random() < ratio:
+                    lookup(handle.snapshot(), value)
+                elif rng.random() < 0.5:
+                    handle.insert(value)
+                else:
+                    handle.delete(value)
+        
+        workers : List[threading.Thread] = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        start : float = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed : float = time.perf_counter() - start
+        results[ratio] = threads * ops / elapsed
+        print(f"{ratio:>6.0%} {threads:>8} {results[ratio]:>10.0f}")
+    return results
+
+# Drive 'clients' coroutines, each awaiting 'writes' random inserts in a 
+# row, against a tree of 'n' values: directly through a VersionedBST 
+# (window None) and through a CoalescingBST for each coalescing window.
+# Prints write throughput, per-write latency and the number of versions 
+# published (each one a root republish and a set of path copies).
+def benchmark_coalescing(windows: Sequence[Optional[float]] = (None, 0.0, 0.0005, 0.002, 0.01),
+                         clients: int = 200, writes: int = 20,
+                         n: int = 10**4) -> Dict[Optional[float], Tuple[float, TimingStats, int]]:
+    """ Returns {window: (writes per second, latency stats, versions)}. """
+    import asyncio
+    import time
+    from bst_async import CoalescingBST
+    from bst_concurrent import VersionedBST
+    
+    async def run(window: Optional[float]) -> Tuple[float, TimingStats, int]:
+        handle : VersionedBST = VersionedBST(from_iterable(default_comparator, [random.random() for _ in range(n)]))
+        front : Optional[CoalescingBST] = None if window is None else CoalescingBST(handle, window)
+        latencies : List[float] = []
+        
+        async def client(seed: int) -> None:
+            rng : random.Random = random.Random(seed)
+            for _ in range(writes):
+                value : float = rng.random()
+                start : int = time.perf_counter_ns()
+                if front is None:
+                    handle.insert(value)
+                    await asyncio.sleep(0)
+                else:
+                    await front.insert(value)
+                latencies.append(time.perf_counter_ns() - start)
+        
+        start : float = time.perf_counter()
+        await asyncio.gather(*(client(i) for i in range(clients)))
+        elapsed : float = time.perf_counter() - start
+        return clients * writes / elapsed, timing_stats(latencies), handle.version
+    
+    results : Dict[Optional[float], Tuple[float, TimingStats, int]] = {}
+    print(f"{'window':>10} {'writes/s':>10} {'median ms':>10} {'p95 ms':>8} {'versions':>9}")
+    for window in windows:
+        results[window] = asyncio.run(run(window))
+        throughput, latency, versions = results[window]
+        label : str = "direct" if window is None else f"{window * 1000:g} ms"
+        print(f"{label:>10} {throughput:>10.0f} {latency.median_ns / 1e6:>10.3f} {latency.p95_ns / 1e6:>8.3f} {versions:>9}")
+    return results
+
+# Time lookups on a random tree of 'n' values under a Zipfian access
+# pattern: the value of popularity rank r (half of all values in the
+# tree, half absent) is drawn with probability proportional to
+# 1 / r**exponent. Measured directly and through a LookupCache of each
+# policy and capacity.
+def benchmark_lookup_cache(n: int = 10**5, exponent: float = 1.1,
+                           capacities: Sequence[int] = (64, 1024, 16384),
+                           policies: Sequence[CachePolicy] = ("lru", "clock"),
+                           seed: int = 0) -> Dict[Tuple[str, int], Tuple[TimingStats, float]]:
+    """ Returns {(policy, capacity): (lookup timing, hit rate)}, with
+        ("direct", 0) for the uncached lookups, and prints the table.
+    """
+    from bst_cache import LookupCache, hit_rate
+    rng : random.Random = random.Random(seed)
+    present : List[float] = [rng.random() for _ in range(n)]
+    tree : bst = from_iterable(default_comparator, present)
+    universe : List[float] = present + [rng.random() for _ in range(n)]
+    rng.shuffle(universe)  # popularity rank -> value
+    weights : List[float] = [1 / rank ** exponent for rank in range(1, len(universe) + 1)]
+    queries : List[float] = rng.choices(universe, weights, k=TIMING_BATCH * (TIMING_WARMUP + TIMING_SAMPLES))
+    
+    results : Dict[Tuple[str, int], Tuple[TimingStats, float]] = {}
+    results[("direct", 0)] = (measure(partial(lookup, tree), queries), 0.0)
+    for policy in policies:
+        for capacity in capacities:
+            cache : LookupCache = LookupCache(tree, capacity, policy)
+            results[(policy, capacity)] = (measure(cache.lookup, queries), hit_rate(cache.stats))
+    
+    print(f"{'policy':>8} {'capacity':>9} {'hit rate':>9} {'median ns':>10} {'speedup':>8}   (n={n}, s={exponent})")
+    direct_ns : float = results[("direct", 0)][0].median_ns
+    for (name, capacity), (timing, rate) in results.items():
+        print(f"{name:>8} {capacity:>9} {rate:>9.3f} {timing.median_ns:>10.0f} {direct_ns / timing.median_ns:>7.1f}x")
+    return results
+
+# Import 'module' in a fresh interpreter under -X importtime (run from
+# this directory) and return its report: {module name: cumulative
+# microseconds} for every module the import loaded.
+def import_report(module: str) -> Dict[str, int]:
+    import subprocess
+    completed : subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True)
+    report : Dict[str, int] = {}
+    for line in completed.stderr.splitlines():
+        fields : List[str] = line.split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            report[fields[2].strip()] = int(fields[1])
+    return report
+
+# Modules that the tree engine and its benchmarks should not pull in at
+# import: plotting, NumPy and heavyweight stdlib packages.
+HEAVY_IMPORTS : Tuple[str, ...] = ("matplotlib", "numpy", "unittest", "statistics", "concurrent.futures")
+
+# Time importing each of 'modules' in 'runs' fresh interpreters and print
+# the median cumulative import time and any HEAVY_IMPORTS each loads.
+# Without cached bytecode (PYTHONDONTWRITEBYTECODE) the times include
+# compiling our own modules.
+def benchmark_import_time(modules: Sequence[str] = ("bst", "bst_graphs", "bst_index"),
+                          runs: int = 5) -> Dict[str, float]:
+    """ Returns {module: median cumulative import time in ms}. """
+    import statistics
+    results : Dict[str, float] = {}
+    print(f"{'module':>12} {'median ms':>10}   heavy imports")
+    for module in modules:
+        reports : List[Dict[str, int]] = [import_report(module) for _ in range(runs)]
+        results[module] = statistics.median(report[module] for report in reports) / 1000
+        heavy : List[str] = [name for name in HEAVY_IMPORTS if name in reports[0]]
+        print(f"{module:>12} {results[module]:>10.1f}   {', '.join(heavy) or '-'}")
+    return results
+
 def create_bst_graphs() -> None:    
     print("Finding n_max for insert timing...")
     n_max = find_n_max_insert()
@@ -0,0 +1,85 @@
+from typing import *
+from dataclasses import dataclass
+import numpy as np
+
+from bst import *
+
+# Immutable, array-backed search index over the values of a
+# BinarySearchTree: the values in order as a read-only NumPy column. 
+# Membership and range queries are answered for whole arrays of values at
+# a time with np.searchsorted, a C-level binary search, instead of a 
+# Python-level pointer chase per level.
+@dataclass(frozen=True)
+class FrozenIndex:
+    keys: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+# Build a FrozenIndex from the values of 'BST', which must be ordered
+# like '<' on them (checked; raises ValueError otherwise). 'dtype' is 
+# inferred by NumPy unless given; numeric values give a compact column,
+# others fall back to an object array compared with '<'.
+def freeze(BST: bst, dtype: Any = None) -> FrozenIndex:
+    keys : np.ndarray = np.array(list(iter_inorder(BST)), dtype=dtype)
+    if keys.ndim != 1:
+        raise ValueError("index values must be scalars.")
+    if len(keys) > 1 and not np.all(keys[:-1] < keys[1:]):
+        raise ValueError("frozen indexes need trees ordered by '<'.")
+    keys.flags.writeable = False
+    return FrozenIndex(keys)
+
+# Returns, for each of 'values', its position in 'index' or -1 if absent.
+def positions_many(index: FrozenIndex, values: Any) -> np.ndarray:
+    queries : np.ndarray = np.asarray(values)
+    if len(index.keys) == 0:
+        return np.full(queries.shape, -1, dtype=np.intp)
+    positions : np.ndarray = np.searchsorted(index.keys, queries, side='left')
+    clipped : np.ndarray = np.minimum(positions, len(index.keys) - 1)
+    found : np.ndarray = (positions < len(index.keys)) & (index.keys[clipped] == queries)
+    return np.where(found, positions, -1)
+
+# Returns a boolean mask telling, for each of 'values', whether it is in
+# 'index'.
+def lookup_many(index: FrozenIndex, values: Any) -> np.ndarray:
+    return positions_many(index, values) >= 0
+
+# Returns the positions in 'index' of the values 'v' with lo <= v <= hi,
+# in order; index.keys[positions] gives the values themselves. O(log n).
+def index_range_query(index: FrozenIndex, lo: Value, hi: Value) -> np.ndarray:
+    start : int = int(np.searchsorted(index.keys, lo, side='left'))
+    stop : int = int(np.searchsorted(index.keys, hi, side='right'))
+    return np.arange(start, max(start, stop))
+
+# Returns a boolean mask over 'values' telling which lie in [lo, hi] and
+# are in 'index'.
+def range_mask(index: FrozenIndex, values: Any, lo: Value, hi: Value) -> np.ndarray:
+    queries : np.ndarray = np.asarray(values)
+    return lookup_many(index, queries) & (lo <= queries) & (queries <= hi)
+
+# Returns a boolean mask telling, for each of 'values', whether it is in
+# the dense tree 'D'. All queries descend together, one vectorized step
+# per tree level, reading the arena's arrays in place; unlike a
+# FrozenIndex this needs no copy and works on any version of a tree that
+# is still being updated (but not while it is appended to).
+def dense_lookup_many(D: DenseBST, values: Any) -> np.ndarray:
+    queries : np.ndarray = np.asarray(values)
+    flat : np.ndarray = queries.reshape(-1)
+    found : np.ndarray = np.zeros(flat.shape, dtype=bool)
+    if D.root < 0:
+        return found.reshape(queries.shape)
+    keys : np.ndarray = np.frombuffer(D.arena.keys, dtype=D.typecode)
+    left : np.ndarray = np.frombuffer(D.arena.left, dtype=np.intc)
+    right : np.ndarray = np.frombuffer(D.arena.right, dtype=np.intc)
+    node : np.ndarray = np.full(flat.shape, D.root, dtype=np.intp)
+    active : np.ndarray = np.arange(len(flat))
+    while len(active):
+        at : np.ndarray = node[active]
+        node_keys : np.ndarray = keys[at]
+        targets : np.ndarray = flat[active]
+        hit : np.ndarray = node_keys == targets
+        found[active[hit]] = True
+        next_node : np.ndarray = np.where(node_keys < targets, right[at], left[at])
+        node[active] = next_node
+        active = active[~hit & (next_node >= 0)]
+    return found.reshape(queries.shape)
@@ -3,9 +3,18 @@ import unittest
 from typing import *
 from dataclasses import dataclass
 import math
-sys.setrecursionlimit(10**6)
+import random
+import statistics
+from types import ModuleType
 
 from bst import *
+import bst_graphs  # imports matplotlib and numpy only when they are used
+
+bst_index : Optional[ModuleType]
+try:
+    import bst_index
+except ImportError:  # numpy not installed
+    bst_index = None
 
 # Point class for Euclidean distance testing
 @dataclass(frozen=True)
@@ -290,5 +299,904 @@ class BSTTests(unittest.TestCase):
         expected_left_value: Value = 3
         self.assertEqual(result.value, expected_left_value)  # Should return left subtree
 
+    def test_weight_balanced_mode(self):
+        """Test the weight-balanced mode keeps O(log n) height on sorted input"""
+        def int_comes_before(a: int, b: int) -> bool:
+            return a < b
+        
+        def height(tree: BinTree) -> int:
+            if tree is None:
+                return 0
+            return 1 + max(height(tree.left), height(tree.right))
+        
+        def assert_weight_balanced(tree: BinTree) -> None:
+            if tree is None:
+                return
+            left_weight = tree_size(tree.left) + 1
+            right_weight = tree_size(tree.right) + 1
+            self.assertLessEqual(left_weight, DELTA * right_weight)
+            self.assertLessEqual(right_weight, DELTA * left_weight)
+            assert_weight_balanced(tree.left)
+            assert_weight_balanced(tree.right)
+        
+        n = 1000
+        bst = BinarySearchTree(int_comes_before, None, "weight")
+        for val in range(n):
+            bst = insert(bst, val)
+        
+        assert_weight_balanced(bst.tree)
+        self.assertEqual(tree_size(bst.tree), n)
+        # A weight-balanced tree with delta = 3 is at most ~2.06 log2(n) tall
+        self.assertLessEqual(height(bst.tree), 2.1 * math.log2(n + 1))
+        for val in range(n):
+            self.assertTrue(lookup(bst, val))
+        self.assertFalse(lookup(bst, n))
+        
+        # Updates return new versions and leave older ones untouched
+        older = bst
+        for val in range(0, n, 2):
+            bst = delete(bst, val)
+        assert_weight_balanced(bst.tree)
+        self.assertEqual(tree_size(bst.tree), n // 2)
+        self.assertEqual(bst.balance, "weight")
+        for val in range(n):
+            self.assertEqual(lookup(bst, val), val % 2 == 1)
+            self.assertTrue(lookup(older, val))
+        
+        with self.assertRaises(ValueError):
+            insert(BinarySearchTree(int_comes_before, None, "avl"), 1)  # type: ignore[arg-type]
+
+    def test_iterative_engine_deep_tree(self):
+        """Test insert/lookup/delete on a degenerate tree without recursion"""
+        def int_comes_before(a: int, b: int) -> bool:
+            return a < b
+        
+        # Small case: the shape matches the classic recursive algorithm
+        bst = BinarySearchTree(int_comes_before, None)
+        for val in [5, 3, 8, 4, 1]:
+            bst = insert(bst, val)
+        expected = Node(5, Node(3, Node(1, None, None), Node(4, None, None)), Node(8, None, None))
+        self.assertEqual(bst.tree, expected)
+        self.assertIs(insert(bst, 4), bst)  # duplicates leave the BST unchanged
+        bst = delete(bst, 3)
+        self.assertEqual(bst.tree, Node(5, Node(1, None, Node(4, None, None)), Node(8, None, None)))
+        
+        # Sorted input builds a linked list far deeper than the recursion limit
+        n = 1000
+        old_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(200)
+        try:
+            bst = BinarySearchTree(int_comes_before, None)
+            for val in range(n):
+                bst = insert(bst, val)
+            self.assertTrue(lookup(bst, n - 1))
+            self.assertFalse(lookup(bst, n))
+            self.assertEqual(largest_value(bst.tree), n - 1)
+            bst = delete(bst, n - 1)
+            self.assertFalse(lookup(bst, n - 1))
+            bst = delete(bst, 0)
+            self.assertFalse(lookup(bst, 0))
+            self.assertEqual(tree_size(delete_largest_value(bst.tree)), n - 3)
+        finally:
+            sys.setrecursionlimit(old_limit)
+
+    def test_compare_and_key_functions(self):
+        """Test BSTs ordered by a cmp-style compare or a cached key function"""
+        def point_comes_before(a: Point2, b: Point2) -> bool:
+            return a.distance_from_zero() < b.distance_from_zero()
+        
+        key_calls = [0]
+        def distance_key(p: Point2) -> float:
+            key_calls[0] += 1
+            return p.distance_from_zero()
+        
+        compare_calls = [0]
+        def point_compare(a: Point2, b: Point2) -> int:
+            compare_calls[0] += 1
+            da, db = a.distance_from_zero(), b.distance_from_zero()
+            return (da > db) - (da < db)
+        
+        points = [Point2(3, 4), Point2(1, 0), Point2(0, 2), Point2(1, 1),
+                  Point2(0, 3), Point2(2, 2), Point2(0, 0)]
+        plain = BinarySearchTree(point_comes_before, None)
+        keyed = BinarySearchTree(point_comes_before, None, key=distance_key)
+        compared = BinarySearchTree(point_comes_before, None, compare=point_compare)
+        for point in points:
+            plain = insert(plain, point)
+            keyed = insert(keyed, point)
+            compared = insert(compared, point)
+        
+        # Same shape regardless of how the order is expressed (keyed nodes
+        # also cache their key, so compare the values only)
+        def shape(tree: BinTree) -> Any:
+            if tree is None:
+                return None
+            return (tree.value, shape(tree.left), shape(tree.right))
+        
+        self.assertEqual(shape(keyed.tree), shape(plain.tree))
+        self.assertEqual(compared.tree, plain.tree)
+        
+        # The key function runs once per operation, never per level
+        key_calls[0] = 0
+        self.assertTrue(lookup(keyed, Point2(-4, -3)))  # same distance as (3, 4)
+        self.assertFalse(lookup(keyed, Point2(0, 4)))
+        self.assertEqual(key_calls[0], 2)
+        
+        # One compare call per level visited
+        compare_calls[0] = 0
+        self.assertTrue(lookup(compared, Point2(0, 0)))
+        self.assertEqual(compare_calls[0], 3)  # path (3,4) -> (1,0) -> (0,0)
+        
+        keyed = delete(keyed, Point2(3, 4))
+        compared = delete(compared, Point2(3, 4))
+        plain = delete(plain, Point2(3, 4))
+        self.assertEqual(shape(keyed.tree), shape(plain.tree))
+        self.assertEqual(compared.tree, plain.tree)
+        self.assertFalse(lookup(keyed, Point2(3, 4)))
+        self.assertTrue(lookup(keyed, Point2(2, 2)))
+        
+        with self.assertRaises(ValueError):
+            BinarySearchTree(point_comes_before, None, compare=point_compare, key=distance_key)
+
+    def test_bulk_construction(self):
+        """Test from_iterable and from_sorted build balanced, deduplicated trees"""
+        def int_comes_before(a: int, b: int) -> bool:
+            return a < b
+        
+        def height(tree: BinTree) -> int:
+            if tree is None:
+                return 0
+            return 1 + max(height(tree.left), height(tree.right))
+        
+        values = [7, 3, 9, 3, 1, 8, 7, 2, 6, 5, 4, 0]
+        bst = from_iterable(int_comes_before, values)
+        self.assertEqual(tree_size(bst.tree), 10)
+        self.assertEqual(height(bst.tree), 4)  # ceil(log2(11))
+        for val in range(10):
+            self.assertTrue(lookup(bst, val))
+        self.assertFalse(lookup(bst, 10))
+        
+        sorted_bst = from_sorted(int_comes_before, range(1000), "weight")
+        self.assertEqual(sorted_bst.balance, "weight")
+        self.assertEqual(height(sorted_bst.tree), 10)
+        sorted_bst = insert(delete(sorted_bst, 500), 1000)
+        self.assertTrue(lookup(sorted_bst, 1000))
+        self.assertFalse(lookup(sorted_bst, 500))
+        
+        with self.assertRaises(ValueError):
+            from_sorted(int_comes_before, [1, 3, 2])
+        self.assertTrue(is_empty(from_iterable(int_comes_before, [])))
+        
+        # Of several equal values the first one is kept, as with insert
+        pairs = [(2, 'a'), (1, 'b'), (2, 'c'), (1, 'd')]
+        by_first = from_iterable(lambda a, b: a[0] < b[0], pairs, key=lambda p: p[0])
+        self.assertEqual(largest_value(by_first.tree), (2, 'a'))
+        self.assertEqual(by_first.tree.key, 2)  # type: ignore[union-attr]
+
+    def test_batch_insert_and_delete(self):
+        """Test insert_many/delete_many against one-at-a-time updates"""
+        def int_comes_before(a: int, b: int) -> bool:
+            return a < b
+        
+        def values_in_order(tree: BinTree) -> List[int]:
+            if tree is None:
+                return []
+            return values_in_order(tree.left) + [tree.value] + values_in_order(tree.right)
+        
+        for balance in ("none", "weight"):
+            bst = from_iterable(int_comes_before, range(0, 200, 2), balance)
+            original = bst
+            
+            batch = [5, 17, 3, 5, 250, 40, -1]  # 40 is already present
+            bst = insert_many(bst, batch)
+            expected = sorted(set(range(0, 200, 2)) | set(batch))
+            self.assertEqual(values_in_order(bst.tree), expected)
+            self.assertEqual(tree_size(bst.tree), len(expected))
+            self.assertEqual(bst.balance, balance)
+            
+            bst = delete_many(bst, [17, 0, 198, 1000, 40, 250])
+            expected = [v for v in expected if v not in (17, 0, 198, 40, 250)]
+            self.assertEqual(values_in_order(bst.tree), expected)
+            
+            # The input version is untouched and no-op batches return it as is
+            self.assertEqual(values_in_order(original.tree), list(range(0, 200, 2)))
+            self.assertIs(insert_many(original, [2, 4, 6]), original)
+            self.assertIs(delete_many(original, [1, 3]), original)
+            self.assertIs(insert_many(original, []), original)
+            
+            # Subtrees away from the batch are shared, not copied
+            updated = insert_many(original, [199])
+            assert original.tree is not None and updated.tree is not None
+            self.assertIs(updated.tree.left, original.tree.left)
+        
+        # A batch into an empty tree builds a balanced tree
+        bst = insert_many(BinarySearchTree(int_comes_before, None), range(1023))
+        self.assertEqual(tree_size(bst.tree), 1023)
+        self.assertEqual(values_in_order(bst.tree), list(range(1023)))
+
+    def test_node_representation_and_memory(self):
+        """Test the tuple-backed Node and memory_footprint"""
+        import pickle
+        
+        node = Node(2, Node(1, None, None), None)
+        match node:
+            case Node(v, l, r):
+                self.assertEqual((v, l, r), (2, Node(1, None, None), None))
+        self.assertEqual(node.size, 2)
+        self.assertFalse(hasattr(node, '__dict__'))
+        with self.assertRaises(AttributeError):
+            node.value = 3  # type: ignore[misc]
+        self.assertEqual(pickle.loads(pickle.dumps(node)), node)
+        self.assertEqual(repr(node), "Node(2, Node(1, None, None), None)")
+        
+        bst = from_iterable(lambda a, b: a < b, range(1000))
+        footprint = memory_footprint(bst)
+        self.assertEqual(footprint.nodes, 1000)
+        self.assertEqual(footprint.node_bytes, 1000 * sys.getsizeof(bst.tree))
+        self.assertEqual(footprint.bytes_per_node, sys.getsizeof(bst.tree))
+        self.assertEqual(memory_footprint(BinarySearchTree(lambda a, b: a < b, None)).nodes, 0)
+
+    def test_single_pass_delete(self):
+        """Test delete compares along one path and returns the BST itself if the value is absent"""
+        calls = [0]
+        def counting_comes_before(a: int, b: int) -> bool:
+            calls[0] += 1
+            return a < b
+        
+        bst = from_sorted(counting_comes_before, range(15))  # perfect tree of height 4
+        assert bst.tree is not None
+        self.assertEqual(bst.tree.value, 7)
+        
+        calls[0] = 0
+        self.assertIs(delete(bst, 100), bst)
+        self.assertLessEqual(calls[0], 2 * 4)  # one descent, at most two calls per level
+        
+        calls[0] = 0
+        smaller = delete(bst, 7)  # the root: promote 6 from the left subtree
+        self.assertEqual(calls[0], 2)
+        assert smaller.tree is not None
+        self.assertEqual(smaller.tree.value, 6)
+        self.assertIs(smaller.tree.right, bst.tree.right)
+        self.assertEqual(tree_size(smaller.tree), 14)
+        for val in range(15):
+            self.assertEqual(lookup(smaller, val), val != 7)
+
+    def test_order_statistics(self):
+        """Test len, select, rank and count_range"""
+        def int_comes_before(a: int, b: int) -> bool:
+            return a < b
+        
+        values = [50, 20, 80, 10, 30, 70, 90, 60, 40]
+        for balance in ("none", "weight"):
+            bst = BinarySearchTree(int_comes_before, None, balance)
+            self.assertEqual(len(bst), 0)
+            for val in values:
+                bst = insert(bst, val)
+            bst = delete(bst, 50)
+            ordered = sorted(v for v in values if v != 50)
+            
+            self.assertEqual(len(bst), len(ordered))
+            for k, val in enumerate(ordered):
+                self.assertEqual(select(bst, k), val)
+                self.assertEqual(rank(bst, val), k)
+            with self.assertRaises(IndexError):
+                select(bst, len(ordered))
+            with self.assertRaises(IndexError):
+                select(bst, -1)
+            
+            self.assertEqual(rank(bst, 0), 0)
+            self.assertEqual(rank(bst, 50), 4)  # absent: values before it
+            self.assertEqual(rank(bst, 100), len(ordered))
+            
+            self.assertEqual(count_range(bst, 20, 70), 5)  # 20 30 40 60 70
+            self.assertEqual(count_range(bst, 21, 69), 3)
+            self.assertEqual(count_range(bst, 0, 1000), len(ordered))
+            self.assertEqual(count_range(bst, 45, 55), 0)
+            self.assertEqual(count_range(bst, 70, 20), 0)
+        
+        # The median of a keyed tree
+        words = from_iterable(lambda a, b: len(a) < len(b), ["ccc", "a", "bb", "dddd", "eeeee"],
+                              key=len)
+        self.assertEqual(select(words, len(words) // 2), "ccc")
+        self.assertEqual(rank(words, "zz"), 1)
+
+    def test_iterators_and_range_query(self):
+        """Test lazy in-order/reversed iteration and range scans"""
+        calls = [0]
+        def counting_comes_before(a: int, b: int) -> bool:
+            calls[0] += 1
+            return a < b
+        
+        bst = from_iterable(counting_comes_before, range(0, 2000, 2))
+        self.assertEqual(list(iter_inorder(bst)), list(range(0, 2000, 2)))
+        self.assertEqual(list(iter_reversed(bst)), list(range(1998, -1, -2)))
+        self.assertEqual(list(iter_inorder(BinarySearchTree(counting_comes_before, None))), [])
+        
+        self.assertEqual(list(range_query(bst, 101, 110)), [102, 104, 106, 108, 110])
+        self.assertEqual(list(range_query(bst, 100, 100)), [100])
+        self.assertEqual(list(range_query(bst, 110, 101)), [])
+        self.assertEqual(list(range_query(bst, -10, 4)), [0, 2, 4])
+        self.assertEqual(list(range_query(bst, 1995, 5000)), [1996, 1998])
+        
+        # Pruned: a short scan makes O(log n) comparisons, not O(n)
+        calls[0] = 0
+        self.assertEqual(len(list(range_query(bst, 1000, 1010))), 6)
+        self.assertLess(calls[0], 60)
+        
+        # Iterators are lazy and stay on the version they started from
+        values = iter_inorder(bst)
+        self.assertEqual(next(values), 0)
+        newer = delete(insert(bst, 1), 2)
+        self.assertEqual(next(values), 2)
+        self.assertEqual(list(iter_inorder(newer))[:3], [0, 1, 4])
+        
+        # Deep, degenerate trees need no recursion
+        deep = BinarySearchTree(counting_comes_before, None)
+        for val in range(500):
+            deep = insert(deep, val)
+        old_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(100)
+        try:
+            self.assertEqual(sum(1 for _ in iter_reversed(deep)), 500)
+            self.assertEqual(list(range_query(deep, 495, 600)), [495, 496, 497, 498, 499])
+        finally:
+            sys.setrecursionlimit(old_limit)
+
+    def test_set_operations(self):
+        """Test split, join, union, intersection and difference"""
+        def int_comes_before(a: int, b: int) -> bool:
+            return a < b
+        
+        for balance in ("none", "weight"):
+            evens = from_iterable(int_comes_before, range(0, 100, 2), balance)
+            threes = BinarySearchTree(int_comes_before, None, balance)
+            for val in [33, 3, 99, 0, 51, 66, 12, 87]:
+                threes = insert(threes, val)
+            evens_set = set(range(0, 100, 2))
+            threes_set = {33, 3, 99, 0, 51, 66, 12, 87}
+            
+            self.assertEqual(list(iter_inorder(union(evens, threes))), sorted(evens_set | threes_set))
+            self.assertEqual(list(iter_inorder(intersection(evens, threes))), sorted(evens_set & threes_set))
+            self.assertEqual(list(iter_inorder(difference(evens, threes))), sorted(evens_set - threes_set))
+            self.assertEqual(list(iter_inorder(difference(threes, evens))), sorted(threes_set - evens_set))
+            self.assertEqual(union(evens, threes).balance, balance)
+            
+            before, found, after = split(evens, 50)
+            self.assertTrue(found)
+            self.assertEqual(list(iter_inorder(before)), list(range(0, 50, 2)))
+            self.assertEqual(list(iter_inorder(after)), list(range(52, 100, 2)))
+            before, found, after = split(evens, 51)
+            self.assertFalse(found)
+            self.assertEqual(len(before) + len(after), len(evens))
+            
+            joined = join(before, after)
+            self.assertEqual(list(iter_inorder(joined)), list(range(0, 100, 2)))
+            with self.assertRaises(ValueError):
+                join(after, before)
+            
+            # Untouched inputs are shared rather than copied
+            empty = BinarySearchTree(int_comes_before, None, balance)
+            self.assertIs(union(evens, empty).tree, evens.tree)
+            self.assertIs(union(evens, evens).tree, evens.tree)
+            self.assertIs(difference(evens, empty).tree, evens.tree)
+            self.assertIs(intersection(evens, evens).tree, evens.tree)
+            self.assertIsNone(intersection(evens, empty).tree)
+        
+        # Of two equal values, union keeps the one from its first argument
+        by_first = lambda a, b: a[0] < b[0]
+        a = from_iterable(by_first, [(1, 'a'), (2, 'a')])
+        b = from_iterable(by_first, [(2, 'b'), (3, 'b')])
+        self.assertEqual(list(iter_inorder(union(a, b))), [(1, 'a'), (2, 'a'), (3, 'b')])
+        
+        with self.assertRaises(ValueError):
+            union(evens, from_iterable(lambda x, y: x > y, [1]))
+        
+        # A tall plain tree gets the recursion it needs only for the
+        # duration of the call
+        n = 20000
+        chain = None
+        for val in range(n - 1, -1, -1):
+            chain = Node(val, None, chain)
+        tall = BinarySearchTree(int_comes_before, chain)
+        extra = from_iterable(int_comes_before, [n + 1, n + 3])
+        limit = sys.getrecursionlimit()
+        self.assertEqual(len(union(tall, extra)), n + 2)
+        self.assertEqual(len(difference(tall, from_iterable(int_comes_before, [n - 1]))), n - 1)
+        self.assertEqual(len(insert_many(tall, [n + 1, n + 3])), n + 2)
+        self.assertEqual(sys.getrecursionlimit(), limit)
+
+    def test_parallel_sampling_is_deterministic(self):
+        """Test sample_trials gives the same heights for any number of workers"""
+        serial = bst_graphs.sample_trials(bst_graphs.height_chunk, 40, trees=600, seed=7,
+                                          workers=1, n_samples=4)
+        parallel = bst_graphs.sample_trials(bst_graphs.height_chunk, 40, trees=600, seed=7,
+                                            workers=3, n_samples=4)
+        self.assertEqual(serial, parallel)
+        self.assertEqual(serial[0], [0.0, 10.0, 20.0, 30.0, 40.0])
+        self.assertEqual(serial[1][0], 0.0)  # empty trees have height 0
+        other_seed = bst_graphs.sample_trials(bst_graphs.height_chunk, 40, trees=600, seed=8,
+                                              workers=1, n_samples=4)
+        self.assertNotEqual(serial[1], other_seed[1])
+
+    def test_timing_harness(self):
+        """Test timing_stats and measure"""
+        stats = bst_graphs.timing_stats([float(v) for v in range(1, 101)])
+        self.assertEqual(stats.samples, 100)
+        self.assertEqual(stats.median_ns, 50.5)
+        self.assertEqual(stats.p95_ns, 95.0)
+        self.assertEqual(stats.mean_ns, 50.5)
+        self.assertLessEqual(stats.ci_low_ns, stats.median_ns)
+        self.assertGreaterEqual(stats.ci_high_ns, stats.median_ns)
+        self.assertEqual((stats.ci_low_ns, stats.ci_high_ns), (41.0, 61.0))
+        
+        calls = []
+        stats = bst_graphs.measure(calls.append, [1, 2, 3], batch=4, samples=5, warmup=2)
+        self.assertEqual(stats.samples, 5)
+        self.assertEqual(len(calls), 4 * 7)
+        self.assertEqual(calls[:5], [1, 2, 3, 1, 2])
+        self.assertGreater(stats.median_ns, 0)
+
+    @unittest.skipIf(bst_index is None, "numpy not installed")
+    def test_numpy_height_simulation(self):
+        """Test the NumPy simulation matches real random trees"""
+        import numpy as np
+        
+        # Exact on a fixed order: inserting 3, 1, 0, 2
+        class FixedOrder:
+            def random(self, shape):
+                return np.array([[0.6, 0.2, 0.9, 0.1]])  # argsort -> 3, 1, 0, 2
+        depths = bst_graphs.simulate_depths(4, 1, FixedOrder())  # type: ignore[arg-type]
+        self.assertEqual(depths.tolist(), [[1, 2, 3, 3]])  # 0 and 2 are both children of 1
+        
+        n, trials = 60, 400
+        rng = random.Random(3)
+        tree_heights = [bst_graphs.calculate_tree_height(bst_graphs.random_tree(n, bst_graphs.default_comparator, rng).tree)
+                        for _ in range(trials)]
+        simulated = bst_graphs.simulate_heights(n, 20 * trials, seed=3, max_cells=10000)
+        self.assertEqual(simulated.shape, (20 * trials,))
+        # sample means agree to well within a few standard errors (sd ~ 1.5)
+        self.assertAlmostEqual(float(simulated.mean()), statistics.fmean(tree_heights), delta=0.35)
+        self.assertAlmostEqual(float(simulated.std()), statistics.pstdev(tree_heights), delta=0.4)
+        self.assertEqual(bst_graphs.simulate_heights(0, 5).tolist(), [0] * 5)
+        self.assertEqual(bst_graphs.simulate_heights(1, 5).tolist(), [1] * 5)
+        
+        # Above SMALL_TREE the size-splitting simulation still matches the
+        # depths of explicitly simulated insertions
+        n = 3 * bst_graphs.SMALL_TREE
+        by_depths = bst_graphs.simulate_depths(n, 2000, np.random.default_rng(5)).max(axis=1)
+        by_sizes = bst_graphs.simulate_heights(n, 20000, seed=5)
+        self.assertAlmostEqual(float(by_sizes.mean()), float(by_depths.mean()), delta=0.2)
+        self.assertAlmostEqual(float(by_sizes.std()), float(by_depths.std()), delta=0.25)
+
+    def test_n_max_calibration(self):
+        """Test calibrate_n_max lands in the window in a few probes"""
+        probes = []
+        def modelled_cost(n: int) -> float:
+            probes.append(n)
+            return 2e-5 + 4e-8 * n * math.log2(n + 1) * (1.1 if n % 2 else 0.9)
+        
+        n_max = bst_graphs.calibrate_n_max(modelled_cost, trees=10000, low=1.5, high=2.5)
+        self.assertTrue(1.5 <= modelled_cost(n_max) * 10000 <= 2.5)
+        self.assertLessEqual(len(probes), 2 + 4)
+        
+        # A cost that jumps past the window never yields an oversized n_max
+        def stepped_cost(n: int) -> float:
+            return 1e-4 if n < 500 else 1e-3
+        n_max = bst_graphs.calibrate_n_max(stepped_cost, trees=10000, low=1.5, high=2.5)
+        self.assertLess(n_max, 500)
+        
+        self.assertEqual(bst_graphs.solve_cost_model(0.0, 1.0, 1.0), 1)
+        a, b = bst_graphs.fit_cost_model([(8, 1.0 + 2.0 * 8 * math.log2(9)),
+                                          (64, 1.0 + 2.0 * 64 * math.log2(65))])
+        self.assertAlmostEqual(a, 1.0)
+        self.assertAlmostEqual(b, 2.0)
+
+    def test_snapshot_save_and_load(self):
+        """Test saving a BST and querying the memory-mapped snapshot"""
+        import os
+        import tempfile
+        def num_comes_before(a: float, b: float) -> bool:
+            return a < b
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ints.bst")
+            values = list(range(-50, 1000, 3))
+            bst = from_iterable(num_comes_before, reversed(values), "weight")
+            save(bst, path)
+            self.assertEqual(os.path.getsize(path), SNAPSHOT_HEADER.size + 8 * len(values))
+            
+            with load(path) as snapshot:
+                self.assertEqual(len(snapshot), len(values))
+                self.assertEqual(snapshot.typecode, 'q')
+                for val in range(-60, 1010):
+                    self.assertEqual(snapshot_lookup(snapshot, val), val in values)
+                self.assertEqual(list(snapshot_range_query(snapshot, 0, 20)), [1, 4, 7, 10, 13, 16, 19])
+                self.assertEqual(list(snapshot_range_query(snapshot, 995, 2000)), [997])
+                self.assertEqual(list(snapshot_range_query(snapshot, 20, 0)), [])
+                restored = snapshot_to_bst(snapshot, num_comes_before)
+                self.assertEqual(list(iter_inorder(restored)), values)
+            
+            # Floats, empty trees and unsupported values
+            path = os.path.join(directory, "floats.bst")
+            save(from_iterable(num_comes_before, [0.5, -2.25, 3]), path)
+            with load(path) as snapshot:
+                self.assertEqual(snapshot.typecode, 'd')
+                self.assertTrue(snapshot_lookup(snapshot, 3))
+                self.assertEqual(list(snapshot_range_query(snapshot, -10, 10)), [-2.25, 0.5, 3.0])
+            save(BinarySearchTree(num_comes_before, None), path)
+            with load(path) as snapshot:
+                self.assertEqual(len(snapshot), 0)
+                self.assertFalse(snapshot_lookup(snapshot, 1))
+            with self.assertRaises(TypeError):
+                save(from_iterable(lambda a, b: a < b, ["a", "b"]), path)
+            with self.assertRaises(ValueError):
+                save(from_iterable(lambda a, b: a > b, [1, 2]), path)  # not ordered by '<'
+            with open(path, "wb") as f:
+                f.write(b"not a snapshot at all")
+            with self.assertRaises(ValueError):
+                load(path)
+
+    @unittest.skipIf(bst_index is None, "numpy not installed")
+    def test_frozen_index(self):
+        """Test freeze, lookup_many and range queries on the array-backed index"""
+        assert bst_index is not None
+        import numpy as np
+        
+        bst = from_iterable(lambda a, b: a < b, [5, 1, 9, 3, 7, 11])
+        index = bst_index.freeze(bst)
+        self.assertEqual(len(index), 6)
+        self.assertEqual(index.keys.tolist(), [1, 3, 5, 7, 9, 11])
+        with self.assertRaises(ValueError):
+            index.keys[0] = 2  # read-only
+        
+        queries = np.array([0, 1, 2, 3, 11, 12, 7])
+        self.assertEqual(bst_index.lookup_many(index, [2.5, 3.0]).tolist(), [False, True])
+        self.assertEqual(bst_index.lookup_many(index, queries).tolist(),
+                         [False, True, False, True, True, False, True])
+        self.assertEqual(bst_index.positions_many(index, queries).tolist(), [-1, 0, -1, 1, 5, -1, 3])
+        self.assertEqual(bst_index.index_range_query(index, 2, 9).tolist(), [1, 2, 3, 4])
+        self.assertEqual(index.keys[bst_index.index_range_query(index, 4, 100)].tolist(), [5, 7, 9, 11])
+        self.assertEqual(bst_index.index_range_query(index, 9, 2).tolist(), [])
+        self.assertEqual(bst_index.range_mask(index, queries, 2, 9).tolist(),
+                         [False, False, False, True, False, False, True])
+        
+        words = bst_index.freeze(from_iterable(lambda a, b: a < b, ["pear", "apple", "fig"]))
+        self.assertEqual(bst_index.lookup_many(words, ["fig", "kiwi"]).tolist(), [True, False])
+        empty = bst_index.freeze(BinarySearchTree(lambda a, b: a < b, None), dtype=float)
+        self.assertEqual(bst_index.lookup_many(empty, [1.0]).tolist(), [False])
+        with self.assertRaises(ValueError):
+            bst_index.freeze(from_iterable(lambda a, b: a > b, [1, 2]))
+
+    def test_diff_between_versions(self):
+        """Test diff reports changes and skips shared subtrees"""
+        calls = [0]
+        def counting_comes_before(a: int, b: int) -> bool:
+            calls[0] += 1
+            return a < b
+        
+        for balance in ("none", "weight"):
+            old = from_iterable(counting_comes_before, range(0, 4000, 2), balance)
+            new = delete(insert(insert(old, 1001), 3), 500)
+            
+            calls[0] = 0
+            changes = list(diff(old, new))
+            self.assertEqual(changes, [Change(True, 3), Change(False, 500), Change(True, 1001)])
+            self.assertLess(calls[0], 300)  # far fewer than the 2000 values
+            self.assertEqual(list(diff(new, old)), [Change(False, 3), Change(True, 500), Change(False, 1001)])
+            self.assertEqual(list(diff(old, old)), [])
+        
+        # Unrelated versions still diff correctly, just without shortcuts
+        a = from_iterable(counting_comes_before, [1, 2, 3, 4])
+        b = BinarySearchTree(counting_comes_before, None)
+        for val in [4, 2, 6]:
+            b = insert(b, val)
+        self.assertEqual(list(diff(a, b)), [Change(False, 1), Change(False, 3), Change(True, 6)])
+        self.assertEqual(list(diff(b, BinarySearchTree(counting_comes_before, None))),
+                         [Change(False, 2), Change(False, 4), Change(False, 6)])
+        with self.assertRaises(ValueError):
+            diff(a, from_iterable(lambda x, y: x < y, [1]))  # raised before iterating
+        
+        # A plain tree from sorted keys is one long chain; diffing it must
+        # not recurse once per level
+        n = 100000
+        chain = None
+        for val in range(n - 1, -1, -1):
+            chain = Node(val, None, chain)
+        old = BinarySearchTree(lambda a, b: a < b, chain)
+        new = insert(old, n + 5)
+        limit = sys.getrecursionlimit()
+        self.assertEqual(list(diff(old, new)), [Change(True, n + 5)])
+        self.assertEqual(list(diff(new, old)), [Change(False, n + 5)])
+        self.assertEqual(sys.getrecursionlimit(), limit)
+
+    def test_versioned_handle(self):
+        """Test VersionedBST publishing, pinning and concurrent writers"""
+        import threading
+        from bst_concurrent import VersionedBST
+        
+        handle = VersionedBST(BinarySearchTree(lambda a, b: a < b, None), history=2)
+        self.assertEqual(handle.version, 0)
+        self.assertEqual(handle.insert(5), 1)
+        self.assertEqual(handle.insert(5), 1)  # no change, no new version
+        pinned = handle.pin()
+        self.assertEqual(handle.insert_many([1, 9]), 2)
+        self.assertEqual(handle.delete(5), 3)
+        self.assertEqual(handle.delete_many([1]), 4)
+        
+        self.assertEqual(list(iter_inorder(handle.snapshot())), [9])
+        self.assertEqual(list(iter_inorder(handle.get(pinned))), [5])  # pinned outlives history
+        self.assertEqual(list(iter_inorder(handle.get(3))), [1, 9])
+        with self.assertRaises(KeyError):
+            handle.get(2)
+        handle.unpin(pinned)
+        with self.assertRaises(KeyError):
+            handle.get(pinned)
+        
+        # A stale compare-and-set is refused
+        version, BST = handle.current()
+        self.assertIsNone(handle.compare_and_set(version - 1, insert(BST, 3)))
+        self.assertEqual(handle.compare_and_set(version, insert(BST, 3)), version + 1)
+        
+        # Concurrent writers never lose an update
+        handle = VersionedBST(BinarySearchTree(lambda a, b: a < b, None))
+        def writer(start: int) -> None:
+            for val in range(start, 2000, 4):
+                handle.insert(val)
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(handle.snapshot()), 2000)
+        self.assertEqual(handle.version, 2000)
+
+    def test_coalescing_async_writes(self):
+        """Test CoalescingBST merges concurrent writes into one version"""
+        import asyncio
+        from bst_async import CoalescingBST
+        from bst_concurrent import VersionedBST
+        
+        async def scenario() -> None:
+            handle = VersionedBST(from_iterable(lambda a, b: a < b, [100, 200]))
+            front = CoalescingBST(handle, window=0.01, max_batch=1000)
+            versions = await asyncio.gather(
+                *(front.insert(val) for val in range(10)),
+                front.delete(100), front.insert(100), front.delete(5))
+            self.assertEqual(set(versions), {1})  # one merged update
+            self.assertEqual(list(iter_inorder(front.snapshot())),
+                             [0, 1, 2, 3, 4, 6, 7, 8, 9, 100, 200])  # applied in order
+            self.assertTrue(front.lookup(200))
+            
+            # Reaching max_batch flushes without waiting for the window
+            front = CoalescingBST(handle, window=60.0, max_batch=3)
+            flushed = await asyncio.wait_for(
+                asyncio.gather(front.insert(-1), front.insert(-2), front.insert(-3)), timeout=5)
+            self.assertEqual(list(flushed), [2, 2, 2])
+            
+            # A bad write fails only its own caller; the rest are published
+            shared = VersionedBST(BinarySearchTree(lambda a, b: a < b, None))
+            mixed = CoalescingBST(shared, window=0)
+            results = await asyncio.gather(mixed.insert(1), mixed.insert("x"), mixed.insert(2),
+                                           mixed.delete(1), return_exceptions=True)
+            self.assertEqual(results[0], 1)
+            self.assertIsInstance(results[1], TypeError)
+            self.assertEqual([results[2], results[3]], [1, 1])
+            self.assertEqual(list(iter_inorder(shared.snapshot())), [2])
+        
+        asyncio.run(scenario())
+
+    def test_instrumentation_stats(self):
+        """Test instrumented operations record comparisons, paths and allocations"""
+        stats = TreeStats()
+        chain = with_stats(BinarySearchTree(lambda a, b: a < b, None), stats)
+        for val in range(1, 6):  # sorted order: a right-leaning chain
+            chain = insert(chain, val)
+        self.assertEqual(stats.insert.calls, 5)
+        self.assertEqual(stats.insert.comparisons, 2 * (0 + 1 + 2 + 3 + 4))
+        self.assertEqual(stats.insert.allocations, 1 + 2 + 3 + 4 + 5)
+        self.assertEqual(stats.insert.path_lengths, {0: 1, 1: 1, 2: 1, 3: 1, 4: 1})
+        
+        self.assertTrue(lookup(chain, 5))
+        self.assertEqual((stats.lookup.comparisons, stats.lookup.nodes_visited), (10, 5))
+        self.assertEqual(stats.lookup.allocations, 0)
+        
+        chain = delete(chain, 5)
+        self.assertEqual((stats.delete.nodes_visited, stats.delete.allocations), (5, 4))
+        self.assertEqual(delete(chain, 42), chain)  # absent: nothing allocated
+        self.assertEqual(stats.delete.allocations, 4)
+        
+        metrics = stats_metrics(stats)
+        self.assertEqual(metrics["insert.max_path_length"], 4)
+        self.assertEqual(metrics["insert.allocations_per_op"], 3.0)
+        self.assertEqual(metrics["lookup.mean_path_length"], 5.0)
+        
+        # Turning stats off stops recording; the tree itself is unchanged
+        plain = with_stats(chain, None)
+        self.assertEqual(plain, chain)
+        self.assertTrue(lookup(insert(plain, 0), 0))
+        self.assertEqual(stats.lookup.calls, 1)
+
+    def test_randomized_mode(self):
+        """Test the randomized mode keeps O(log n) expected height on sorted input"""
+        def int_comes_before(a: int, b: int) -> bool:
+            return a < b
+        
+        def height(tree: BinTree) -> int:
+            if tree is None:
+                return 0
+            return 1 + max(height(tree.left), height(tree.right))
+        
+        rng = random.Random(21)
+        n = 1000
+        bst = BinarySearchTree(int_comes_before, None, "randomized", rng=rng)
+        for val in range(n):
+            bst = insert(bst, val)
+        self.assertEqual(list(iter_inorder(bst)), list(range(n)))
+        self.assertEqual(insert(bst, 500), bst)  # duplicate: unchanged
+        self.assertLess(height(bst.tree), 4 * math.log2(n))  # a plain BST has height n
+        
+        for val in range(n - 1, -1, -2):  # reverse order deletes
+            bst = delete(bst, val)
+        self.assertEqual(list(iter_inorder(bst)), list(range(0, n, 2)))
+        self.assertLess(height(bst.tree), 4 * math.log2(n))
+        self.assertEqual(bst.tree.size, n // 2)
+        
+        # Batch and set operations keep the mode and the contents
+        evens = insert_many(bst, range(n, n + 10))
+        self.assertEqual(len(evens), n // 2 + 10)
+        odds = from_iterable(int_comes_before, range(1, n, 2), "randomized")
+        self.assertEqual(list(iter_inorder(union(bst, odds))), list(range(n)))
+        self.assertEqual(union(bst, odds).balance, "randomized")
+        self.assertEqual(len(difference(evens, bst)), 10)
+        
+        # The tree's own generator drives the mode: the same seed gives
+        # the same shape, and the global generator is not touched
+        state = random.getstate()
+        def build(seed):
+            tree = BinarySearchTree(int_comes_before, None, "randomized", rng=random.Random(seed))
+            for val in range(200):
+                tree = insert(tree, val)
+            return tree
+        self.assertEqual(build(5).tree, build(5).tree)
+        self.assertEqual(random.getstate(), state)
+
+    def test_lookup_cache(self):
+        """Test LookupCache answers like lookup and evicts by LRU or CLOCK"""
+        from bst_cache import LookupCache, CacheStats, hit_rate
+        bst = from_iterable(lambda a, b: a < b, [1, 2, 3, 5, 8])
+        
+        cache = LookupCache(bst, capacity=2)
+        self.assertEqual([cache.lookup(val) for val in (1, 4, 1, 3, 4)],
+                         [True, False, True, True, False])
+        # 4 was least recently used when 3 came in, so it missed again
+        self.assertEqual(cache.stats, CacheStats(hits=1, misses=4, evictions=2))
+        self.assertEqual(hit_rate(cache.stats), 0.2)
+        self.assertEqual(len(cache), 2)
+        
+        clock = LookupCache(bst, capacity=2, policy="clock")
+        for val in (1, 4, 1, 3):  # the hit on 1 gives it a second chance
+            clock.lookup(val)
+        self.assertTrue(clock.lookup(1))
+        self.assertEqual((clock.stats.hits, clock.stats.evictions), (2, 1))
+        
+        # Unhashable values bypass the cache
+        lists = LookupCache(from_iterable(lambda a, b: a < b, [[1], [2]]))
+        self.assertTrue(lists.lookup([2]))
+        self.assertEqual((lists.stats.uncacheable, len(lists)), (1, 0))
+        
+        with self.assertRaises(ValueError):
+            LookupCache(bst, capacity=0)
+        with self.assertRaises(ValueError):
+            LookupCache(bst, policy="fifo")
+
+    def test_dense_engine(self):
+        """Test the dense engine matches the node engine and is picked by typecode"""
+        values = [5, 3, 8, 1, 4, 7, 9, 3]
+        dense = from_iterable(default_comparator, values, typecode='q')
+        self.assertIs(type(dense), DenseBST)
+        # Any other ordering or balancing cannot be dense
+        with self.assertRaises(ValueError):
+            from_iterable(lambda a, b: a < b, values, typecode='q')
+        with self.assertRaises(ValueError):
+            from_iterable(default_comparator, values, "weight", typecode='q')
+        
+        node = from_iterable(default_comparator, values)
+        for val in (0, 2, 6, 10, 4):  # insert, then delete in a different order
+            dense, node = insert(dense, val), insert(node, val)
+        for val in (5, 1, 42, 10, 8):
+            older = dense
+            dense, node = delete(dense, val), delete(node, val)
+        self.assertEqual(list(iter_inorder(dense)), list(iter_inorder(node)))
+        self.assertEqual(len(dense), len(node))
+        self.assertTrue(lookup(older, 8))  # earlier versions are untouched
+        self.assertFalse(lookup(dense, 8))
+        self.assertIs(insert(dense, 4), dense)
+        self.assertIs(delete(dense, 42), dense)
+        
+        # The other operations either agree with the node engine or
+        # refuse dense trees outright
+        self.assertEqual(list(iter_reversed(dense)), list(iter_reversed(node)))
+        self.assertEqual(list(range_query(dense, 3, 7)), list(range_query(node, 3, 7)))
+        self.assertEqual(list(range_query(dense, 11, 20)), [])
+        self.assertFalse(is_empty(dense))
+        self.assertTrue(is_empty(dense_empty()))
+        self.assertEqual(list(iter_inorder(insert_many(dense, [12, 0, 12]))),
+                         list(iter_inorder(insert_many(node, [12, 0, 12]))))
+        self.assertEqual(list(iter_inorder(delete_many(dense, [2, 3, 99]))),
+                         list(iter_inorder(delete_many(node, [2, 3, 99]))))
+        for refused in (lambda: select(dense, 0), lambda: rank(dense, 3), lambda: split(dense, 3),
+                        lambda: union(dense, dense), lambda: diff(dense, dense),
+                        lambda: with_stats(dense, TreeStats()), lambda: memory_footprint(dense)):
+            with self.assertRaises(TypeError):
+                refused()
+        from bst_concurrent import VersionedBST
+        with self.assertRaises(TypeError):
+            VersionedBST(dense)
+        handle = VersionedBST(node)
+        with self.assertRaises(TypeError):
+            handle.compare_and_set(handle.version, dense)
+        
+        compact = dense_compact(dense)
+        self.assertEqual(len(compact.arena.keys), len(dense))
+        self.assertEqual(list(iter_inorder(dense_to_bst(compact))), list(iter_inorder(node)))
+        
+        with self.assertRaises(TypeError):
+            insert(dense, 2.5)  # a float in an int64 tree
+        with self.assertRaises(OverflowError):
+            insert(dense, 2 ** 70)
+        self.assertEqual(list(iter_inorder(dense)), list(iter_inorder(node)))
+        with self.assertRaises(ValueError):
+            dense_empty('f')
+        
+        # A float arena refuses ints it would round onto another key
+        floats = from_iterable(default_comparator, [0.0, 1.0], typecode='d')
+        floats = insert(floats, 2 ** 53)
+        with self.assertRaises(ValueError):
+            insert(floats, 2 ** 53 + 1)
+        self.assertEqual(list(iter_inorder(floats)), [0.0, 1.0, 2.0 ** 53])
+        self.assertFalse(lookup(floats, 2 ** 53 + 1))
+        with self.assertRaises(ValueError):
+            from_iterable(default_comparator, [1.0, 2 ** 53 + 1], typecode='d')
+        
+        # Updates compact the arena once it outgrows the tree, and the
+        # versions left in the old arena stay valid
+        first = from_iterable(default_comparator, range(0, 4000, 2), typecode='q')
+        dense, compactions = first, 0
+        for val in range(1, 4000, 2):
+            previous = dense
+            dense = delete(insert(dense, val), val - 1)
+            compactions += dense.arena is not previous.arena
+            self.assertLessEqual(dense.appended, max(DENSE_GROWTH * len(dense), DENSE_MIN_ARENA))
+            self.assertLessEqual(len(dense.arena.keys), len(dense) + 1 + max(DENSE_GROWTH * len(dense), DENSE_MIN_ARENA))
+        self.assertGreater(compactions, 1)
+        self.assertEqual(list(iter_inorder(dense)), list(range(1, 4000, 2)))
+        self.assertEqual(list(iter_inorder(first)), list(range(0, 4000, 2)))
+        # ... and branching off them does not recompact on every update
+        self.assertIs(insert(first, 1).arena, first.arena)
+    
+    @unittest.skipIf(bst_index is None, "numpy not installed")
+    def test_dense_lookup_many(self):
+        """Test vectorized lookups on a dense tree agree with lookup"""
+        dense = from_iterable(default_comparator, [0.5, 1.5, 2.5], typecode='d')
+        dense = delete(insert(dense, 3.5), 1.5)
+        queries = [0.5, 1.5, 2.5, 3.5, 4.0, -1.0]
+        self.assertEqual(bst_index.dense_lookup_many(dense, queries).tolist(),
+                         [lookup(dense, val) for val in queries])
+        self.assertEqual(bst_index.dense_lookup_many(dense_empty(), [1.0]).tolist(), [False])
+
+    def test_imports_are_light(self):
+        """Test importing bst and bst_graphs loads no heavy modules and changes no global state"""
+        import os
+        import subprocess
+        # -X importtime lists every module an import loads
+        report = bst_graphs.import_report("bst_graphs")
+        self.assertIn("bst", report)
+        self.assertEqual([name for name in bst_graphs.HEAVY_IMPORTS if name in report], [])
+        
+        script = "import sys; limit = sys.getrecursionlimit(); import bst, bst_graphs; print(sys.getrecursionlimit() - limit)"
+        completed = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   capture_output=True, text=True, check=True)
+        self.assertEqual(completed.stdout.strip(), "0")
+
 if (__name__ == '__main__'):
     unittest.main()
\ No newline at end of file